@@ -0,0 +1,236 @@
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+__all__ = (
+    "EROSION_DEFAULTS",
+    "hydraulic_erosion",
+    "thermal_erosion",
+    "erode_grid",
+    "erode_heights"
+    )
+
+# Iteration budgets and model constants; erode_heights() takes any subset of these keys in its params dict.
+EROSION_DEFAULTS = {'hydraulic_iterations':60, 'thermal_iterations':30, 'dt':0.1, 'gravity':9.81, 'rain':0.02, \
+    'evaporation':0.05, 'capacity':1.0, 'erosion':0.3, 'deposition':0.3, 'min_tilt':0.05, 'talus':0.7, 'thermal_rate':0.5}
+
+# Interior tile size and overlap of the tile-parallel mode. Water and sediment only travel a few cells per iteration,
+# so with a wide enough halo the tiles give nearly the same result as eroding the whole grid at once.
+TILE_SIZE = 512
+TILE_HALO = 32
+
+#------------------------------------------------------------------------------------------------------------------
+
+# Differences h - h_neighbor towards the left, right, upper and lower neighbors, 0 past the edges of the grid.
+def neighbor_diffs(h, out):
+    out[0][:, 0] = 0
+    out[1][:, -1] = 0
+    out[2][0] = 0
+    out[3][-1] = 0
+    np.subtract(h[:, 1:], h[:, :-1], out=out[0][:, 1:])
+    np.subtract(h[:, :-1], h[:, 1:], out=out[1][:, :-1])
+    np.subtract(h[1:], h[:-1], out=out[2][1:])
+    np.subtract(h[:-1], h[1:], out=out[3][:-1])
+    return out
+
+# What each cell receives from its neighbors' outflows; flux is the (4, rows, cols) outflow to the left, right, upper
+# and lower neighbors.
+def inflow(flux, out):
+    out.fill(0)
+    out[:, 1:] += flux[1][:, :-1]
+    out[:, :-1] += flux[0][:, 1:]
+    out[1:] += flux[3][:-1]
+    out[:-1] += flux[2][1:]
+    return out
+
+# Total outflow of each cell, flux.sum(axis=0) without the temporary.
+def outflow(flux, out):
+    np.add(flux[0], flux[1], out=out)
+    out += flux[2]
+    out += flux[3]
+    return out
+
+# Mean of the flow into and out of each cell, along x (cols) into flow_x and y (rows) into flow_y.
+def net_flow(flux, flow_x, flow_y):
+    np.subtract(flux[1], flux[0], out=flow_x)
+    flow_x[:, 1:] += flux[1][:, :-1]
+    flow_x[:, :-1] -= flux[0][:, 1:]
+    np.subtract(flux[3], flux[2], out=flow_y)
+    flow_y[1:] += flux[3][:-1]
+    flow_y[:-1] -= flux[2][1:]
+    flow_x *= 0.5
+    flow_y *= 0.5
+
+# Grid-based hydraulic erosion with the virtual pipe model: rain fills a water layer, which flows to lower neighbors
+# through outflow pipes. Flowing water picks up sediment up to a capacity that grows with slope and speed, drops it
+# where it slows down. Sediment moves through the same pipes as the water that carries it, so no material is lost
+# or created. Every step is an array operation over the whole grid, written into work arrays that are allocated once,
+# since a fresh temporary per operation took more time than the arithmetic.
+def hydraulic_erosion(z, iterations, cell_width=1, dt=0.1, gravity=9.81, rain=0.02, evaporation=0.05, capacity=1.0, \
+    erosion=0.3, deposition=0.3, min_tilt=0.05):
+    z = np.array(z, dtype=np.float32)
+    rows, cols = z.shape
+    if rows < 2 or cols < 2:
+        return z
+    water = np.zeros_like(z)
+    sediment = np.zeros_like(z)
+    flux = np.zeros((4, rows, cols), dtype=np.float32)
+    dh = np.empty_like(flux)
+    prev_water, mean_water, u, v, a, b = (np.empty_like(z) for _ in range(6))
+    mask = np.empty(z.shape, dtype=bool)
+    area = cell_width*cell_width
+
+    for _ in range(iterations):
+        water += rain*dt
+
+        # Outflow pipes, scaled down where they would drain more water than the cell holds.
+        dh = neighbor_diffs(np.add(z, water, out=a), dh)
+        dh *= dt*gravity/cell_width
+        flux += dh
+        np.maximum(flux, 0, out=flux)
+        outflow(flux, a)
+        a *= dt
+        np.maximum(a, 1e-12, out=a)
+        np.multiply(water, area, out=b)
+        b /= a
+        np.minimum(b, 1, out=b)
+        flux *= b
+
+        np.copyto(prev_water, water)
+        inflow(flux, a)
+        a -= outflow(flux, b)
+        a *= dt/area
+        water += a
+        np.maximum(water, 0, out=water)
+
+        # Flow speed u, v; cells that are nearly dry get none.
+        np.add(prev_water, water, out=mean_water)
+        mean_water *= 0.5
+        np.greater(mean_water, 1e-4, out=mask)
+        np.maximum(mean_water, 1e-4, out=a)
+        a *= cell_width
+        net_flow(flux, u, v)
+        u /= a
+        u *= mask
+        v /= a
+        v *= mask
+
+        # Erosion where the water can carry more than it does, deposition where it carries too much. The capacity
+        # grows with the amount of water, so a thin film of rain does not carve the slopes.
+        grad_r, grad_c = np.gradient(z, cell_width)
+        grad_r *= grad_r
+        grad_c *= grad_c
+        slope2 = np.add(grad_r, grad_c, out=grad_r)
+        tilt = np.divide(slope2, np.add(slope2, 1, out=grad_c), out=slope2)
+        np.sqrt(tilt, out=tilt)
+        np.maximum(tilt, min_tilt, out=tilt)
+        u *= u
+        v *= v
+        u += v
+        speed = np.sqrt(u, out=u)
+        sediment_capacity = np.multiply(tilt, capacity, out=tilt)
+        sediment_capacity *= speed
+        sediment_capacity *= mean_water
+        diff = np.subtract(sediment_capacity, sediment, out=sediment_capacity)
+        change = np.multiply(diff, deposition, out=a)
+        np.multiply(diff, erosion, out=change, where=np.greater(diff, 0, out=mask))
+        z -= change
+        sediment += change
+
+        # Each pipe takes the share of the sediment that matches its share of the water that was in the cell.
+        np.maximum(prev_water, 1e-12, out=prev_water)
+        np.multiply(sediment, dt/area, out=b)
+        b /= prev_water
+        moved = np.multiply(flux, b, out=dh)
+        inflow(moved, a)
+        a -= outflow(moved, b)
+        sediment += a
+        water *= 1 - evaporation*dt
+
+    z += sediment
+    return z
+
+# Thermal (talus) erosion: wherever the drop to a neighbor is steeper than the talus slope, a share of the excess
+# material slides down, split between the lower neighbors in proportion to how far they exceed it.
+def thermal_erosion(z, iterations, cell_width=1, talus=0.7, thermal_rate=0.5):
+    z = np.array(z, dtype=np.float32)
+    diffs = np.empty((4,) + z.shape, dtype=np.float32)
+    moved, scale = np.empty_like(z), np.empty_like(z)
+    positive = np.empty(z.shape, dtype=bool)
+    threshold = talus*cell_width
+
+    for _ in range(iterations):
+        excess = neighbor_diffs(z, diffs)
+        excess -= threshold
+        np.maximum(excess, 0, out=excess)
+        total = outflow(excess, scale)
+        np.max(excess, axis=0, out=moved)
+        moved *= 0.5*thermal_rate
+        # moved/total where any material moves, 0 (as moved is) elsewhere.
+        np.divide(moved, total, out=scale, where=np.greater(total, 0, out=positive))
+        share = np.multiply(excess, scale, out=excess)
+        z -= moved
+        z[:, :-1] += share[0][:, 1:]
+        z[:, 1:] += share[1][:, :-1]
+        z[:-1] += share[2][1:]
+        z[1:] += share[3][:-1]
+    return z
+
+def erode_grid(z, cell_width, params):
+    p = {**EROSION_DEFAULTS, **(params or {})}
+    z = hydraulic_erosion(z, p['hydraulic_iterations'], cell_width, p['dt'], p['gravity'], p['rain'], p['evaporation'], \
+        p['capacity'], p['erosion'], p['deposition'], p['min_tilt'])
+    return thermal_erosion(z, p['thermal_iterations'], cell_width, p['talus'], p['thermal_rate'])
+
+#------------------------------------------------------------------------------------------------------------------
+
+def erode_tile(src_name, dst_name, shape, r0, r1, c0, c1, halo, cell_width, params):
+    src = shared_memory.SharedMemory(name=src_name)
+    dst = shared_memory.SharedMemory(name=dst_name)
+    try:
+        z_src = np.ndarray(shape, dtype=np.float64, buffer=src.buf)
+        z_dst = np.ndarray(shape, dtype=np.float64, buffer=dst.buf)
+        hr0, hc0 = max(r0-halo, 0), max(c0-halo, 0)
+        hr1, hc1 = min(r1+halo, shape[0]), min(c1+halo, shape[1])
+        z = erode_grid(z_src[hr0:hr1, hc0:hc1], cell_width, params)
+        z_dst[r0:r1, c0:c1] = z[r0-hr0:r1-hr0, c0-hc0:c1-hc0]
+        del z_src, z_dst
+    finally:
+        src.close()
+        dst.close()
+
+# Erodes the heights z of a row_lines x col_lines grid (flat, as built by the gen_*_mesh functions). With
+# num_workers = 0 the whole grid is eroded at once. Otherwise it is split into tiles that are eroded with a halo of
+# surrounding cells, which is cut off again afterwards, on a process pool (num_workers > 1) or one by one.
+# Erosion is slow next to generating the heights: with the default iterations, a 1025x1025 grid takes about 6 s and
+# a 2049x2049 one about 30 s in a single process. For large grids use the tile mode, whose tiles also fit the CPU
+# caches better (about 27 s for 2049x2049 one tile at a time) and which divides that by up to num_workers cores.
+def erode_heights(z, row_lines, col_lines, cell_width=1, params=None, num_workers=0, tile_size=TILE_SIZE, halo=TILE_HALO, \
+    mp_context=None):
+    shape = (row_lines, col_lines)
+    if num_workers == 0:
+        return erode_grid(np.reshape(z, shape), cell_width, params).astype(np.float64).ravel()
+
+    tiles = [(r0, min(r0+tile_size, row_lines), c0, min(c0+tile_size, col_lines)) \
+        for r0 in range(0, row_lines, tile_size) for c0 in range(0, col_lines, tile_size)]
+    nbytes = row_lines*col_lines*np.dtype(np.float64).itemsize
+    src = shared_memory.SharedMemory(create=True, size=nbytes)
+    dst = shared_memory.SharedMemory(create=True, size=nbytes)
+    try:
+        np.ndarray(shape, dtype=np.float64, buffer=src.buf)[:] = np.reshape(z, shape)
+        if num_workers <= 1:
+            for r0, r1, c0, c1 in tiles:
+                erode_tile(src.name, dst.name, shape, r0, r1, c0, c1, halo, cell_width, params)
+        else:
+            with ProcessPoolExecutor(max_workers=num_workers, mp_context=mp_context) as executor:
+                futures = [executor.submit(erode_tile, src.name, dst.name, shape, r0, r1, c0, c1, halo, cell_width, params) \
+                    for r0, r1, c0, c1 in tiles]
+                for future in futures:
+                    future.result()
+        z = np.ndarray(shape, dtype=np.float64, buffer=dst.buf).copy()
+    finally:
+        for shm in (src, dst):
+            shm.close()
+            shm.unlink()
+    return z.ravel()
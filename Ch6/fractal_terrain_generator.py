@@ -3,280 +3,90 @@ import numpy as np
 import bmesh
 import bpy
 from mathutils import Vector
-from mathutils import noise
 
-from enum import Enum, unique
-from math import ceil, floor, log2, pow
 import timeit
 import random
+import tempfile
+
+import multiprocessing
+import os, sys
+script_dir = ""
+if bpy.context.space_data and bpy.context.space_data.text:
+    script_filepath = bpy.context.space_data.text.filepath
+    if script_filepath:
+        script_dir = os.path.dirname(script_filepath)
+        if not script_dir in sys.path:
+            sys.path.append(script_dir)
+
+from height_map_utils import ElevType, InterpType, grid_topology, quad_loop_starts
+from noise_utils import NoiseBackend
+from terrain_core import grid_verts, fractal_grid_verts, finish_height_map, PREVIEW_STRIDES, progressive_height_maps
+from terrain_tiles import TerrainTileStream
+from height_cache import HeightMapCache, cached_height_map
+from terrain_pipeline import PIPELINE_STAGES, HeightPipeline
+from terrain_jobs import JobState, HeightJob
+from terrain_lod import LOD_STRIDES, CHUNK_SIZE, lod_chain, lod_index
+from terrain_scatter import scatter_points
 
-def get_context_override(context, area_type, region_type):
-    override = context.copy()
-    for area in override['screen'].areas:
-        if area.type == area_type: # e.g. 'VIEW_3D' for viewport, 'IMAGE_EDITOR' for UV/Image Editor, etc.
-            override['area'] = area
-            break
-    for region in override['area'].regions:
-        if region.type == region_type: # e.g. 'WINDOW'
-            override['region'] = region
-            break
-    return override
-            
 #------------------------------------------------------------------------------------------------------------------            
 bl_noise_basis_options = ['BLENDER','PERLIN_ORIGINAL','PERLIN_NEW','VORONOI_F1','VORONOI_F2','VORONOI_F3','VORONOI_F4',\
     'VORONOI_F2F1','VORONOI_CRACKLE','CELLNOISE']
 
-@unique
-class ElevType(str, Enum):
-    Random = "random"
-    DiamondSquare = "diamond_square"
-    HybridMultiFractal = "hybrid_multi_fractal"
-    BlenderMultiFractal = "blender_multi_fractal"
-    BlenderHeteroTerrain = "blender_hetero_terrain"
-    
-@unique
-class InterpType(str, Enum):
-    Bilinear = "bilinear"
-    Bicubic = "bicubic"
-
-#------------------------------------------------------------------------------------------------------------------
-
-def cubic(x):
-    return -2*pow(x, 3) + 3*pow(x, 2)
-
-def bidir_interp(interp_type, verts, row_lines, col_lines, step_size):
-    half_step = step_size/2
-    for row in range(row_lines):
-        for col in range(col_lines):
-            rq = row//step_size
-            rr = row%step_size
-            r_sm = step_size*rq
-            r_lg = r_sm+step_size
-            r_lg = np.clip(r_lg, r_sm, row_lines-1)
-            r_cls = r_sm if rr <= half_step else r_lg
-            
-            cq = col//step_size
-            cr = col%step_size
-            c_sm = step_size*cq
-            c_lg = c_sm+step_size
-            c_lg = np.clip(c_lg, c_sm, col_lines-1)
-            c_cls = c_sm if cr <= half_step else c_lg
-            h_itrp, v_itrp = 0, 0
-            
-            dc_s = 1-((col-c_sm)/step_size)
-            dc_l = 1-((c_lg-col)/step_size)
-            dr_s = 1-((row-r_sm)/step_size)
-            dr_l = 1-((r_lg-row)/step_size)
-            
-            h_sm = r_cls*col_lines + c_sm
-            h_lg = r_cls*col_lines + c_lg
-            v_sm = r_sm*col_lines + c_cls
-            v_lg = r_lg*col_lines + c_cls
-            
-            match interp_type:
-                case InterpType.Bilinear:
-                    h_itrp = dc_s*verts[h_sm][2] + dc_l*verts[h_lg][2]
-                    v_itrp = dr_s*verts[v_sm][2] + dr_l*verts[v_lg][2]
-                case InterpType.Bicubic:
-                    h_itrp = cubic(dc_s)*verts[h_sm][2] + cubic(dc_l)*verts[h_lg][2]
-                    v_itrp = cubic(dr_s)*verts[v_sm][2] + cubic(dr_l)*verts[v_lg][2]                               
-            
-            verts[row*row_lines + col][2] = (h_itrp+v_itrp)*0.5
-            
-#--------------------------------------------------------------------------------------------------------
-            
-def gen_random_map(num_pts, h_min, h_max, noise_basis, x, y):
-    if noise_basis=='UNIFORM':
-        z = np.random.uniform(h_min, h_max, (num_pts,))
-        verts = np.stack([x, y, z], axis=-1).reshape(num_pts, 3)
-        return verts
-    else:
-        z = np.zeros(num_pts)
-        verts = np.stack([x, y, z], axis=-1).reshape(num_pts, 3)
-        z = np.array([noise.noise([v[0]*0.05, v[1]*0.05, 1], noise_basis=noise_basis)*20 for v in verts])
-        verts = np.stack([x, y, z], axis=-1).reshape(num_pts, 3)
-        return verts
-            
-def fbm_sum(verts, interp_type, noise_basis, unit_size, h_min, h_max, num_octaves, row_lines, col_lines, num_pts, x, y):
-    if unit_size < 1 or num_octaves < 1:
-        return
-    div_pow = [int(pow(2, i)) for i in range(0, num_octaves)]
-    for dp in div_pow:
-        step_size = floor(unit_size//dp)
-        if step_size < 1:
-            break
-        
-        verts_this_oct = gen_random_map(num_pts, h_min, h_max, noise_basis, x, y)
-        bidir_interp(interp_type, verts_this_oct, row_lines, col_lines, step_size)
-        verts += (1/dp)*verts_this_oct
-        
-#--------------------------------------------------------------------------------------------------------
-
-def sample_ds_noise(h_min, h_max):
-    dsn = (h_max-h_min)*np.random.sample()+h_min
-    return dsn
-
-def diamond_square_step(s, grid, h_min, h_max):
-    h, w  = grid.shape
-    for r in range(0, h, s):
-        for c in range(0, w, s):
-            r_s = (r+s)%h
-            c_s = (c+s)%w
-            square = np.array([grid[r][c], grid[r][c_s], grid[r_s][c_s], grid[r_s][c]])
-            hs = s//2
-            sc = np.mean(square) + sample_ds_noise(h_min, h_max)
-            r_hs = (r+hs)%h
-            c_hs = (c+hs)%w
-            grid[r_hs][c_hs] = sc
-                      
-            diamond_0 = np.array([grid[r_hs][(c-hs)%w], grid[r][c], sc, grid[r_s][c]])
-            grid[r_hs][c] = np.mean(diamond_0) + np.random.uniform(h_min, h_max)
-            
-            diamond_1 = np.array([grid[r][c], grid[(r-hs)%h][c_hs], grid[r][c_s], sc])
-            grid[r][c_hs] = np.mean(diamond_1) + np.random.uniform(h_min, h_max)
-            
-            diamond_2 = np.array([sc, grid[r][c_s], grid[r_hs][(c+s+hs)%w], grid[r_s][c_s]])
-            grid[r_hs][c_s] = np.mean(diamond_2) + np.random.uniform(h_min, h_max)
-            
-            diamond_3 = np.array([grid[r_s][c], sc, grid[r_s][c_s], grid[(r+s+hs)%h][c_hs]])
-            grid[r_s][c_hs] = np.mean(diamond_3) + np.random.uniform(h_min, h_max)
-            
-def diamond_square(n, grid, h_min, h_max, r_decay_factor):
-    step = n-1
-    while step >= 1:
-        diamond_square_step(step, grid, h_min, h_max)
-        step = step//2
-        decay = pow(2, -r_decay_factor)
-        h_min *= decay
-        h_max *= decay
-        
-    return grid
-
-def gen_diamond_square_map(row_lines, num_pts, h_min, h_max):
-    n = row_lines
-    ds_grid = np.zeros((n,n), dtype=np.float16)
-    h_range = h_max-h_min
+# Optional HeightMapCache used by the gen_*_mesh functions, e.g. set in __main__ so that re-running the galleries
+# reads unchanged heightmaps from disk. Without it, the fractal gen_*_mesh functions write their heights straight
+# into the vertex buffer (see fractal_grid_verts()).
+height_cache = None
 
-    ds_grid[0, 0] = sample_ds_noise(h_min, h_max)
-    ds_grid[0, n-1] = sample_ds_noise(h_min, h_max)
-    ds_grid[n-1, 0] = sample_ds_noise(h_min, h_max)
-    ds_grid[n-1, n-1] = sample_ds_noise(h_min, h_max)
-    
-    diamond_square(n, ds_grid, h_min, h_max, 0.3)
-    z = ds_grid.flatten()
-    return z
-    
 #-------------------------------------------------------------------------------------------------------
 
-def hybrid_multi_fractal2(v, H=0.25, lacunarity=2, octaves=10, offset=0.7, noise_basis='BLENDER'):
-    exp_array = []
-    frequency = 1.0
-    for i in range(octaves+1):
-        exp_array.append(pow(frequency, -H))
-        frequency *= lacunarity
-
-    for i in range(octaves):
-        if i == 0:
-            altitude = (noise.noise(v, noise_basis=noise_basis) + offset) * exp_array[0]
-            weight = altitude
-        else:
-            weight = min(weight, 1.0)
-            signal = (noise.noise(v, noise_basis=noise_basis) + offset) * exp_array[i]
-            altitude += weight * signal
-            weight *= signal
-
-        v = [v[i]*lacunarity for i in range(3)]
-
-    return altitude
+def fill_grid_mesh(mesh, verts, faces):
+    num_faces = len(faces)
+    mesh.vertices.add(len(verts))
+    mesh.vertices.foreach_set("co", verts.ravel())
+    mesh.loops.add(num_faces*4)
+    mesh.loops.foreach_set("vertex_index", faces.ravel())
+    mesh.polygons.add(num_faces)
+    mesh.polygons.foreach_set("loop_start", quad_loop_starts(num_faces))
+    # Blender 4.0+ derives loop_total from loop_start.
+    if not mesh.polygons.bl_rna.properties['loop_total'].is_readonly:
+        mesh.polygons.foreach_set("loop_total", np.full(num_faces, 4, dtype=np.int32))
+    mesh.update(calc_edges=True)
 
-#-------------------------------------------------------------------------------------------------------
-
-def create_blank_height_map(rows, cols, elev_type):
-    if elev_type == ElevType.DiamondSquare:
-        rows = 2**ceil(log2(rows-1))
-        cols = rows
-    row_lines = rows + 1
-    col_lines = cols + 1
-    num_pts = row_lines*col_lines
-    
-    v_indices = np.arange(0, num_pts, 1).reshape((row_lines, col_lines))
-    h_edges = np.zeros((row_lines, cols*2), dtype=np.int32)
-    v_edges = np.zeros((rows, col_lines*2), dtype=np.int32)
-
-    for i in range(row_lines):
-        h_edges[i][0::2] = v_indices[i][:-1]
-        h_edges[i][1::2] = v_indices[i][1:]
-        if i < rows:
-            v_edges[i][0::2] = v_indices[i]
-            v_edges[i][1::2] = v_indices[i+1]
-    
-    num_edges = row_lines*cols + rows*col_lines
-    edges = np.concatenate((h_edges.flatten(), v_edges.flatten())).reshape(num_edges, 2).tolist()
-    
-    x = np.arange(0, col_lines, 1)
-    x = np.stack([x for i in range(row_lines)]).flatten()
-    y = np.arange(0, row_lines, 1).reshape((row_lines, 1))
-    y = np.hstack([y for i in range(col_lines)]).reshape((row_lines, col_lines)).flatten()
-    z = np.zeros(num_pts)
-        
-    return row_lines, col_lines, num_pts, edges, x, y, z
-
-def create_mesh_obj(context, elev_type, noise_basis, verts, edges):
+def create_mesh_obj(context, elev_type, noise_basis, verts, faces):
     grid_mesh_data = bpy.data.meshes.new(name=elev_type+"_"+noise_basis+"_grid_mesh")
-    grid_mesh_data.from_pydata(verts, edges, [])
-    grid_mesh_data.update(calc_edges=True)
+    fill_grid_mesh(grid_mesh_data, verts, faces)
     grid_mesh_obj = bpy.data.objects.new(name=elev_type+"_"+noise_basis+"_grid_obj", object_data=grid_mesh_data)
     context.collection.objects.link(grid_mesh_obj)
     return grid_mesh_obj
 
-def add_border(z, row_lines, col_lines, elev_type):
-    zero_row = np.zeros(col_lines)
-    border = 5 if elev_type == ElevType.Random or elev_type == ElevType.DiamondSquare else 1
-    zero_border = np.zeros(border)
-
-    for r in range(row_lines):
-        i = col_lines*r
-        top_border = r < border
-        bot_border = r >= row_lines-border
-        if top_border or bot_border:
-                z[i:(i+col_lines)] = zero_row
-        else:
-            z[i:(i+border)] = zero_border
-            z[(i+col_lines-border):(i+col_lines)] = zero_border
-            
-def resize_move_and_fill(context, grid_mesh_obj, cell_width, origin):
+# Whether mesh is a grid of row_lines x col_lines vertices with grid_quad_faces(), whose first face ends on the
+# first vertex of the second row. A vertex count alone would also match the grid with rows and columns swapped.
+def is_grid_mesh(mesh, row_lines, col_lines):
+    if len(mesh.vertices) != row_lines*col_lines or len(mesh.polygons) != (row_lines-1)*(col_lines-1):
+        return False
+    return len(mesh.polygons) == 0 or mesh.polygons[0].vertices[3] == col_lines
+
+# Deletes a mesh object, and its mesh unless another object still uses it.
+def remove_mesh_obj(grid_mesh_obj):
+    mesh = grid_mesh_obj.data
+    bpy.data.objects.remove(grid_mesh_obj)
+    if mesh is not None and mesh.users == 0:
+        bpy.data.meshes.remove(mesh)
+
+def select_only(context, grid_mesh_obj):
     for obj in context.view_layer.objects:
         obj.select_set(False)
     context.view_layer.objects.active = grid_mesh_obj
     grid_mesh_obj.select_set(True)
-        
-    c_o = get_context_override(context, 'VIEW_3D', 'WINDOW')
-    with bpy.context.temp_override(**c_o):
-        bpy.ops.object.mode_set(mode='OBJECT')
-        
-    c_o = get_context_override(context, 'VIEW_3D', 'WINDOW')
-    with context.temp_override(**c_o):        
-        bpy.ops.transform.resize(value=(cell_width, cell_width, 1))
-        bpy.ops.transform.translate(value=origin)
-        bpy.ops.object.transform_apply(location=True, rotation=False, scale=True)
-        
-    c_o = get_context_override(context, 'VIEW_3D', 'WINDOW')
-    with bpy.context.temp_override(**c_o):
-        bpy.ops.object.mode_set(mode='EDIT')
-        
-    c_o = get_context_override(context, 'VIEW_3D', 'WINDOW')
-    with bpy.context.temp_override(**c_o):
-        bpy.ops.mesh.select_all(action='SELECT')
-        bpy.ops.mesh.edge_face_add()
-        bpy.ops.object.mode_set(mode='OBJECT')
-        
+
 #-------------------------------------------------------------------------------------------------------
 
-def add_modifiers(is_fractal, grid_mesh_obj):
+# Non-fractal meshes whose heights were smoothed by filters (see height_filters.py) need no DECIMATE/SUBSURF stack.
+def add_modifiers(is_fractal, grid_mesh_obj, filtered=False):
     if is_fractal:
         subsurf_mod = grid_mesh_obj.modifiers.new(grid_mesh_obj.name+"_subsurf_mod", 'SUBSURF')
         subsurf_mod.levels = 1
-    else:
+    elif not filtered:
         decimate_mod = grid_mesh_obj.modifiers.new(grid_mesh_obj.name+"_decimate_mod", 'DECIMATE')
         decimate_mod.decimate_type = 'UNSUBDIV'
         decimate_mod.iterations = 3
@@ -284,78 +94,502 @@ def add_modifiers(is_fractal, grid_mesh_obj):
         subsurf_mod = grid_mesh_obj.modifiers.new(grid_mesh_obj.name+"_subsurf_mod", 'SUBSURF')
         subsurf_mod.levels = 2  
 
-def finish_mesh(context, cell_width, origin, elev_type, chop_border, noise_basis, row_lines, col_lines, num_pts, edges, x, y, z, is_fractal):
-    if chop_border:
-        add_border(z, row_lines, col_lines, elev_type)    
-    verts = np.stack([x, y, z], axis=-1).reshape(num_pts, 3)
-    verts = verts.tolist()
-    
-    grid_mesh_obj = create_mesh_obj(context, elev_type, noise_basis, verts, edges)    
-    resize_move_and_fill(context, grid_mesh_obj, cell_width, origin)
-    add_modifiers(is_fractal, grid_mesh_obj) 
+# erosion is None, or a dict of erode_heights() params (see EROSION_DEFAULTS) plus an optional 'num_workers' for
+# the tile-parallel mode. Erosion runs on the raw heights, before the border is chopped. filters is None (or empty),
+# or a list of filter_heights() dicts applied after erosion, e.g. [{'type':'gaussian', 'sigma':2}].
+def finish_mesh(context, cell_width, origin, elev_type, chop_border, noise_basis, row_lines, col_lines, num_pts, faces, x, y, z, is_fractal, \
+    erosion=None, filters=None):
+    z = finish_height_map(z, row_lines, col_lines, elev_type, cell_width, chop_border, erosion, pool_context(), filters)
+    verts = grid_verts(cell_width, origin, num_pts, x, y, z)
+    return add_grid_mesh_obj(context, elev_type, noise_basis, verts, faces, is_fractal, bool(filters))
+
+def add_grid_mesh_obj(context, elev_type, noise_basis, verts, faces, is_fractal, filtered=False):
+    grid_mesh_obj = create_mesh_obj(context, elev_type, noise_basis, verts, faces)    
+    select_only(context, grid_mesh_obj)
+    add_modifiers(is_fractal, grid_mesh_obj, filtered) 
+    return grid_mesh_obj
+
+# Whether a fractal gen_*_mesh call can build its vertex buffer with fractal_grid_verts(): only when nothing needs
+# the whole heightmap at once.
+def use_fractal_grid_verts(num_workers, erosion):
+    return height_cache is None and num_workers == 0 and erosion is None
 
+# Worker processes are forked where possible: a spawned worker would re-run this script, which needs bpy.
+def pool_context():
+    return multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+
+# The gen_*_mesh functions below are the Blender adapters of the *_height_map() functions in terrain_core.py. Unlike
+# those, they default to NoiseBackend.Mathutils, Blender's own noise, so the terrains look as they always have; pass
+# NoiseBackend.NumPy for the much faster batched noise, which resembles it but gives different heights.
 def gen_hybrid_multi_fractal_mesh(context, rows, cols, cell_width, origin, chop_border, noise_basis, \
-    xy_scale=0.025, lacunarity=3, octaves=5, offset=0.25, z_scale=1):
+    xy_scale=0.025, lacunarity=3, octaves=5, offset=0.25, z_scale=1, noise_backend=NoiseBackend.Mathutils, num_workers=0, erosion=None):
     elev_type = ElevType.HybridMultiFractal
-    row_lines, col_lines, num_pts, edges, x, y, z = create_blank_height_map(rows, cols, elev_type)
-    verts = np.stack([x, y, z], axis=-1).reshape(num_pts, 3)
-    verts = verts.tolist()
-
-    z = [hybrid_multi_fractal2([v[0]*xy_scale, v[1]*xy_scale, 1], H=0.25, lacunarity=lacunarity, octaves=octaves, offset=offset, noise_basis=noise_basis)*z_scale for v in verts]
-    
-    finish_mesh(context, cell_width, origin, elev_type, chop_border, noise_basis, row_lines, col_lines, num_pts, edges, x, y, z, True)
+    row_lines, col_lines, num_pts, faces, x, y = grid_topology(rows, cols, elev_type)
+    if use_fractal_grid_verts(num_workers, erosion):
+        verts = fractal_grid_verts(elev_type, rows, cols, cell_width, origin, noise_basis, xy_scale, lacunarity, octaves, offset, \
+            z_scale, chop_border, noise_backend)
+        return add_grid_mesh_obj(context, elev_type, noise_basis, verts, faces, True)
+    z = cached_height_map(height_cache, 'hybrid_multi_fractal', dict(rows=rows, cols=cols, noise_basis=noise_basis, xy_scale=xy_scale, \
+        lacunarity=lacunarity, octaves=octaves, offset=offset, z_scale=z_scale, noise_backend=noise_backend, num_workers=num_workers, \
+        mp_context=pool_context()))
+    finish_mesh(context, cell_width, origin, elev_type, chop_border, noise_basis, row_lines, col_lines, num_pts, faces, x, y, z, True, erosion)
 
 def gen_bl_fractal_mesh(context, rows, cols, cell_width, origin, elev_type=ElevType.HybridMultiFractal, \
-    chop_border=True, noise_basis='PERLIN_NEW', z_scale=1):
-    
-    row_lines, col_lines, num_pts, edges, x, y, z = create_blank_height_map(rows, cols, elev_type)
-    verts = np.stack([x, y, z], axis=-1).reshape(num_pts, 3)
-    verts = verts.tolist()
-    
-    match elev_type:
-        case ElevType.BlenderMultiFractal:
-            z = [noise.multi_fractal((v[0]*0.01, v[1]*0.01, 1), 0.7, 2.0, 8, noise_basis=noise_basis)*z_scale for v in verts]
-        case ElevType.BlenderHeteroTerrain:
-            z = [noise.hetero_terrain((v[0]*0.01, v[1]*0.01, 1), 0.25, 2, 10, 0.5, noise_basis=noise_basis)*z_scale for v in  verts]
-    
-    finish_mesh(context, cell_width, origin, elev_type, chop_border, noise_basis, row_lines, col_lines, num_pts, edges, x, y, z, True)
+    chop_border=True, noise_basis='PERLIN_NEW', z_scale=1, noise_backend=NoiseBackend.Mathutils, num_workers=0, erosion=None):
+    row_lines, col_lines, num_pts, faces, x, y = grid_topology(rows, cols, elev_type)
+    if use_fractal_grid_verts(num_workers, erosion) and elev_type != ElevType.HybridMultiFractal:
+        verts = fractal_grid_verts(elev_type, rows, cols, cell_width, origin, noise_basis, z_scale=z_scale, chop_border=chop_border, \
+            noise_backend=noise_backend)
+        return add_grid_mesh_obj(context, elev_type, noise_basis, verts, faces, True)
+    z = cached_height_map(height_cache, 'blender_multi_fractal', dict(rows=rows, cols=cols, elev_type=elev_type, noise_basis=noise_basis, \
+        z_scale=z_scale, noise_backend=noise_backend, num_workers=num_workers, mp_context=pool_context()))
+    finish_mesh(context, cell_width, origin, elev_type, chop_border, noise_basis, row_lines, col_lines, num_pts, faces, x, y, z, True, erosion)
 
-def gen_ds_mesh(context, rows, cols, cell_width, origin, unit_size=10, h_min=-50, h_max=50, chop_border=True):
+def gen_ds_mesh(context, rows, cols, cell_width, origin, unit_size=10, h_min=-50, h_max=50, chop_border=True, \
+    interp_type=InterpType.Bicubic, dtype=np.float32, erosion=None, seed=0, filters=None):
     elev_type = ElevType.DiamondSquare
-    row_lines, col_lines, num_pts, edges, x, y, z = create_blank_height_map(rows, cols, elev_type)
-    z = gen_diamond_square_map(row_lines, num_pts, h_min, h_max)
-    verts = np.stack([x, y, z], axis=-1).reshape(num_pts, 3)
-    bidir_interp(InterpType.Bicubic, verts, row_lines, col_lines, unit_size)
-    z = verts[:,2]
-    finish_mesh(context, cell_width, origin, elev_type, chop_border, 'UNIFORM', row_lines, col_lines, num_pts, edges, x, y, z, False)
+    row_lines, col_lines, num_pts, faces, x, y = grid_topology(rows, cols, elev_type)
+    z = cached_height_map(height_cache, 'diamond_square', dict(rows=rows, cols=cols, unit_size=unit_size, h_min=h_min, h_max=h_max, \
+        interp_type=interp_type, dtype=dtype, seed=seed))
+    finish_mesh(context, cell_width, origin, elev_type, chop_border, 'UNIFORM', row_lines, col_lines, num_pts, faces, x, y, z, False, erosion, \
+        filters)
     
-def gen_random_fbm_mesh(context, rows, cols, cell_width, origin, noise_basis, unit_size=5, h_min=-50, h_max=50, num_octaves=4, chop_border=True):
+def gen_random_fbm_mesh(context, rows, cols, cell_width, origin, noise_basis, unit_size=5, h_min=-50, h_max=50, num_octaves=4, chop_border=True, \
+    interp_type=InterpType.Bicubic, lattice_only=False, noise_backend=NoiseBackend.Mathutils, num_workers=0, erosion=None, seed=0, \
+    filters=None):
     elev_type = ElevType.Random
-    row_lines, col_lines, num_pts, edges, x, y, z = create_blank_height_map(rows, cols, elev_type)
-    
-    verts = np.zeros((num_pts, 3))
-    fbm_unit_size = pow(2, num_octaves-1)*unit_size
-    fbm_sum(verts, InterpType.Bicubic, noise_basis, fbm_unit_size, h_min, h_max, num_octaves, row_lines, col_lines, num_pts, x, y)
-
-    z = verts[:,2]
+    row_lines, col_lines, num_pts, faces, x, y = grid_topology(rows, cols, elev_type)
+    z = cached_height_map(height_cache, 'random_fbm', dict(rows=rows, cols=cols, noise_basis=noise_basis, unit_size=unit_size, h_min=h_min, \
+        h_max=h_max, num_octaves=num_octaves, interp_type=interp_type, lattice_only=lattice_only, noise_backend=noise_backend, \
+        num_workers=num_workers, mp_context=pool_context(), seed=seed))
     finish_mesh(context, cell_width, origin, elev_type, chop_border, noise_basis+"_"+str(num_octaves), row_lines, col_lines, \
-        num_pts, edges, x, y, z, False)
+        num_pts, faces, x, y, z, False, erosion, filters)
     
-def gen_random_mesh(context, rows, cols, cell_width, origin, noise_basis, unit_size=5, h_min=-50, h_max=50, chop_border=True):
+def gen_random_mesh(context, rows, cols, cell_width, origin, noise_basis, unit_size=5, h_min=-50, h_max=50, chop_border=True, \
+    interp_type=InterpType.Bicubic, lattice_only=False, noise_backend=NoiseBackend.Mathutils, num_workers=0, erosion=None, seed=0, \
+    filters=None):
     elev_type = ElevType.Random
-    row_lines, col_lines, num_pts, edges, x, y, z = create_blank_height_map(rows, cols, elev_type)
+    row_lines, col_lines, num_pts, faces, x, y = grid_topology(rows, cols, elev_type)
+    z = cached_height_map(height_cache, 'random', dict(rows=rows, cols=cols, noise_basis=noise_basis, unit_size=unit_size, h_min=h_min, \
+        h_max=h_max, interp_type=interp_type, lattice_only=lattice_only, noise_backend=noise_backend, num_workers=num_workers, \
+        mp_context=pool_context(), seed=seed))
+    finish_mesh(context, cell_width, origin, elev_type, chop_border, noise_basis, row_lines, col_lines, num_pts, faces, x, y, z, False, erosion, \
+        filters)
+    
+def gen_spectral_mesh(context, rows, cols, cell_width, origin, beta=2.4, h_min=-50, h_max=50, seed=0, periodic=False, \
+    chop_border=True, erosion=None):
+    elev_type = ElevType.Spectral
+    row_lines, col_lines, num_pts, faces, x, y = grid_topology(rows, cols, elev_type)
+    z = cached_height_map(height_cache, 'spectral', dict(rows=rows, cols=cols, beta=beta, h_min=h_min, h_max=h_max, seed=seed, \
+        periodic=periodic))
+    finish_mesh(context, cell_width, origin, elev_type, chop_border, "beta_"+str(beta), row_lines, col_lines, num_pts, faces, \
+        x, y, z, True, erosion)
+
+#-------------------------------------------------------------------------------------------------------
+
+# Moves the vertices of an existing grid mesh to new heights, keeping its topology, modifiers and selection.
+def set_mesh_heights(mesh, cell_width, origin, elev_type, chop_border, row_lines, col_lines, num_pts, x, y, z):
+    z = finish_height_map(z, row_lines, col_lines, elev_type, cell_width, chop_border)
+    mesh.vertices.foreach_set("co", grid_verts(cell_width, origin, num_pts, x, y, z).ravel())
+    mesh.update()
+
+# Progressive previews still refining, by object name.
+preview_jobs = {}
+
+# Refines a preview mesh one stage of progressive_height_maps() per bpy.app.timers call, so Blender stays
+# responsive in between. Cancelled jobs stop at their next call.
+class PreviewJob:
+    def __init__(self, grid_mesh_obj, stages, cell_width, origin, elev_type, chop_border, rows, cols):
+        self.grid_mesh_obj = grid_mesh_obj
+        self.obj_name = grid_mesh_obj.name
+        self.stages = stages
+        self.cell_width = cell_width
+        self.origin = origin
+        self.elev_type = elev_type
+        self.chop_border = chop_border
+        self.rows = rows
+        self.cols = cols
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+        self.stages.close()
+
+    def finish(self):
+        if preview_jobs.get(self.obj_name) is self:
+            del preview_jobs[self.obj_name]
+        return None
+
+    def step(self):
+        stage = None if self.cancelled else next(self.stages, None)
+        if stage is None:
+            return self.finish()
+
+        stride, z = stage
+        row_lines, col_lines, num_pts, faces, x, y = grid_topology(self.rows, self.cols, self.elev_type)
+        try:
+            set_mesh_heights(self.grid_mesh_obj.data, self.cell_width, self.origin, self.elev_type, self.chop_border, row_lines, \
+                col_lines, num_pts, x, y, z)
+        except ReferenceError:
+            # The object was deleted while refining.
+            self.cancelled = True
+        return self.finish() if self.cancelled or stride == 1 else 0.0
+
+# Shows a fractal terrain at 1/8 resolution right away, then refines it to 1/4, 1/2 and full resolution from timers.
+# Pass the returned object back in as grid_mesh_obj when the parameters change: its running refinement is cancelled
+# and the same mesh is updated in place (or rebuilt, if rows/cols changed). noise_backend defaults to Blender's noise
+# like gen_hybrid_multi_fractal_mesh and gen_bl_fractal_mesh, so the full-resolution stage is the mesh they build.
+def gen_preview_fractal_mesh(context, rows, cols, cell_width, origin, elev_type=ElevType.HybridMultiFractal, chop_border=True, \
+    noise_basis='PERLIN_NEW', xy_scale=0.025, lacunarity=3, octaves=5, offset=0.25, z_scale=1, grid_mesh_obj=None, \
+    strides=PREVIEW_STRIDES, noise_backend=NoiseBackend.Mathutils):
+    row_lines, col_lines, num_pts, faces, x, y = grid_topology(rows, cols, elev_type)
+    stages = progressive_height_maps(elev_type, rows, cols, noise_basis, z_scale, xy_scale, lacunarity, octaves, offset, strides, \
+        noise_backend)
+    stride, z = next(stages)
+
+    if grid_mesh_obj is not None:
+        old_job = preview_jobs.pop(grid_mesh_obj.name, None)
+        if old_job is not None:
+            old_job.cancel()
+        if not is_grid_mesh(grid_mesh_obj.data, row_lines, col_lines):
+            remove_mesh_obj(grid_mesh_obj)
+            grid_mesh_obj = None
+
+    if grid_mesh_obj is None:
+        grid_mesh_obj = finish_mesh(context, cell_width, origin, elev_type, chop_border, noise_basis, row_lines, col_lines, num_pts, \
+            faces, x, y, z, True)
+    else:
+        set_mesh_heights(grid_mesh_obj.data, cell_width, origin, elev_type, chop_border, row_lines, col_lines, num_pts, x, y, z)
+
+    if stride != 1:
+        job = PreviewJob(grid_mesh_obj, stages, cell_width, origin, elev_type, chop_border, rows, cols)
+        preview_jobs[grid_mesh_obj.name] = job
+        bpy.app.timers.register(job.step, first_interval=0.0)
+    return grid_mesh_obj
+
+#-------------------------------------------------------------------------------------------------------
+
+# A terrain mesh that keeps its HeightPipeline, so a change only re-runs what depends on it: new generator params
+# re-evaluate the noise, z_scale/erosion/filters/chop_border only redo the post-processing of the kept raw heights,
+# cell_width/origin only move the vertices, and is_fractal only swaps the modifiers. The mesh is updated in place.
+class TerrainMeshPipeline:
+    def __init__(self, context, generator, params, cell_width=1, origin=(0,0,0), z_scale=1, erosion=None, chop_border=True, \
+        is_fractal=None, seed=None, filters=None):
+        self.context = context
+        self.heights = HeightPipeline(generator, params, z_scale, erosion, chop_border, cell_width, seed, height_cache, \
+            pool_context(), filters)
+        self.origin = origin
+        self.is_fractal = self.heights.elev_type not in (ElevType.Random, ElevType.DiamondSquare) if is_fractal is None else is_fractal
+        self.filtered = bool(filters)
+        self.grid_mesh_obj = None
+
+    def update(self, **changes):
+        origin = changes.pop('origin', self.origin)
+        is_fractal = changes.pop('is_fractal', self.is_fractal)
+        heights_changed = self.heights.update(**changes) < len(PIPELINE_STAGES)
+        moved = tuple(origin) != tuple(self.origin)
+        self.origin = origin
+        filtered = bool(self.heights.settings['filters'])
+
+        z = self.heights.heights()
+        row_lines, col_lines, num_pts, faces, x, y = self.heights.grid()
+        if self.grid_mesh_obj is None or not is_grid_mesh(self.grid_mesh_obj.data, row_lines, col_lines):
+            if self.grid_mesh_obj is not None:
+                remove_mesh_obj(self.grid_mesh_obj)
+            verts = grid_verts(self.heights.settings['cell_width'], origin, num_pts, x, y, z)
+            self.grid_mesh_obj = create_mesh_obj(self.context, self.heights.elev_type, self.heights.settings['generator'], verts, faces)
+            select_only(self.context, self.grid_mesh_obj)
+            add_modifiers(is_fractal, self.grid_mesh_obj, filtered)
+        else:
+            if heights_changed or moved:
+                mesh = self.grid_mesh_obj.data
+                mesh.vertices.foreach_set("co", grid_verts(self.heights.settings['cell_width'], origin, num_pts, x, y, z).ravel())
+                mesh.update()
+            if is_fractal != self.is_fractal or filtered != self.filtered:
+                for mod in list(self.grid_mesh_obj.modifiers):
+                    self.grid_mesh_obj.modifiers.remove(mod)
+                add_modifiers(is_fractal, self.grid_mesh_obj, filtered)
+        self.is_fractal = is_fractal
+        self.filtered = filtered
+        return self.grid_mesh_obj
+
+#-------------------------------------------------------------------------------------------------------
+
+# Background terrain jobs still running, by the name of the object they build or update.
+terrain_jobs = {}
+
+# Seconds between two bpy.app.timers calls of a running TerrainJob.
+JOB_POLL_INTERVAL = 0.1
+
+# The terrain_jobs key of a job named name: the name of grid_mesh_obj, or of the object the job will create.
+def terrain_job_key(name, grid_mesh_obj):
+    return name+"_grid_obj" if grid_mesh_obj is None else grid_mesh_obj.name
+
+# Replaces the mesh of grid_mesh_obj in one assignment, so the viewport never shows a half-built mesh. The new mesh
+# takes over the old one's name if nothing else uses the old one.
+def swap_mesh_data(grid_mesh_obj, mesh):
+    old_mesh = grid_mesh_obj.data
+    grid_mesh_obj.data = mesh
+    if old_mesh.users == 0:
+        name = old_mesh.name
+        bpy.data.meshes.remove(old_mesh)
+        mesh.name = name
+
+# Polls a HeightJob from bpy.app.timers until its heights are done, then builds the mesh off-screen and swaps it in.
+# on_progress(job) is called whenever job.progress or job.stage change.
+class TerrainJob:
+    def __init__(self, context, name, height_job, cell_width, origin, is_fractal, filtered, grid_mesh_obj=None, on_progress=None):
+        self.name = name
+        self.obj_name = terrain_job_key(name, grid_mesh_obj)
+        self.height_job = height_job
+        self.collection = context.collection
+        self.cell_width = cell_width
+        self.origin = origin
+        self.is_fractal = is_fractal
+        self.filtered = filtered
+        self.grid_mesh_obj = grid_mesh_obj
+        self.on_progress = on_progress
+        self.stage = None
+        self.progress = 0.0
+        # Blender finds a timer by the identity of its function, and every self.step is a new bound method, so the
+        # one that is registered is kept.
+        self.timer = self.step
+
+    @property
+    def state(self):
+        return self.height_job.state
+
+    def start(self):
+        terrain_jobs[self.obj_name] = self
+        bpy.app.timers.register(self.timer, first_interval=0.0)
+
+    def cancel(self):
+        self.height_job.cancel()
+        if bpy.app.timers.is_registered(self.timer):
+            bpy.app.timers.unregister(self.timer)
+        self.finish()
+
+    def finish(self):
+        if terrain_jobs.get(self.obj_name) is self:
+            del terrain_jobs[self.obj_name]
+        return None
+
+    def report(self, stage, progress):
+        if (stage, progress) != (self.stage, self.progress):
+            self.stage, self.progress = stage, progress
+            if self.on_progress is not None:
+                self.on_progress(self)
+
+    # The heights take all but the last step of the progress, the mesh the last one.
+    def step(self):
+        state = self.height_job.poll()
+        num_steps = len(PIPELINE_STAGES)+1
+        self.report(self.height_job.stage, self.height_job.stages_done/num_steps)
+        match state:
+            case JobState.Running:
+                return JOB_POLL_INTERVAL
+            case JobState.Failed:
+                print("Terrain job " + self.name + " failed:\n" + self.height_job.error)
+                return self.finish()
+            case JobState.Cancelled:
+                return self.finish()
+
+        try:
+            self.swap_in(self.height_job.z)
+        except ReferenceError:
+            # The object was deleted while generating.
+            return self.finish()
+        self.report('mesh', 1.0)
+        return self.finish()
+
+    # Raises ReferenceError, leaving no new mesh behind, if grid_mesh_obj has been deleted.
+    def swap_in(self, z):
+        heights = self.height_job.pipeline
+        row_lines, col_lines, num_pts, faces, x, y = heights.grid()
+        verts = grid_verts(self.cell_width, self.origin, num_pts, x, y, z)
+        mesh = bpy.data.meshes.new(name=self.name+"_grid_mesh")
+        fill_grid_mesh(mesh, verts, faces)
+        if self.grid_mesh_obj is None:
+            self.grid_mesh_obj = bpy.data.objects.new(name=self.name+"_grid_obj", object_data=mesh)
+            add_modifiers(self.is_fractal, self.grid_mesh_obj, self.filtered)
+            self.collection.objects.link(self.grid_mesh_obj)
+            return
+        try:
+            swap_mesh_data(self.grid_mesh_obj, mesh)
+        except ReferenceError:
+            bpy.data.meshes.remove(mesh)
+            raise
+
+# Generates a terrain without blocking Blender: the heights of a HeightPipeline (see TerrainMeshPipeline for the
+# arguments) are computed in a worker process while a timer polls for progress. in_process runs one whole pipeline
+# stage per timer call instead, which blocks Blender for as long as each stage takes (see HeightJob). The mesh
+# appears as the object name+"_grid_obj", or replaces the mesh of grid_mesh_obj, only once it is complete. The job is
+# kept in terrain_jobs under the name of that object, and a job still running for the same object is cancelled.
+# Returns the TerrainJob; cancel() stops it.
+def gen_terrain_async(context, name, generator, params, cell_width=1, origin=(0,0,0), z_scale=1, erosion=None, chop_border=True, \
+    filters=None, seed=None, is_fractal=None, grid_mesh_obj=None, in_process=False, on_progress=None):
+    if grid_mesh_obj is not None:
+        name = grid_mesh_obj.name
+    old_job = terrain_jobs.get(terrain_job_key(name, grid_mesh_obj))
+    if old_job is not None:
+        old_job.cancel()
+
+    heights = HeightPipeline(generator, params, z_scale, erosion, chop_border, cell_width, seed, height_cache, None, filters)
+    if is_fractal is None:
+        is_fractal = heights.elev_type not in (ElevType.Random, ElevType.DiamondSquare)
+    height_job = HeightJob(heights, in_process, pool_context())
+    job = TerrainJob(context, name, height_job, cell_width, origin, is_fractal, bool(filters), grid_mesh_obj, on_progress)
+    job.start()
+    return job
+
+#-------------------------------------------------------------------------------------------------------
+
+# Plain meshes for the chunked LOD chain of the flat heights z (see terrain_lod.py), an alternative to the
+# DECIMATE/SUBSURF modifiers that keeps every LOD as real geometry. Returns {(chunk_row, chunk_col): [obj per stride]};
+# only LOD 0 is visible until set_visible_lods() picks the levels for a viewer position.
+def gen_lod_meshes(context, name, z, row_lines, col_lines, cell_width=1, origin=(0,0,0), chunk_size=CHUNK_SIZE, \
+    strides=LOD_STRIDES, skirt_depth=None):
+    lod_objs = {}
+    for chunk, stride, verts, faces in lod_chain(z, row_lines, col_lines, cell_width, origin, chunk_size, strides, skirt_depth):
+        lod = len(lod_objs.setdefault(chunk, []))
+        obj_name = name+"_lod"+str(lod)+"_"+str(chunk[0])+"_"+str(chunk[1])
+        lod_mesh_data = bpy.data.meshes.new(name=obj_name+"_mesh")
+        fill_grid_mesh(lod_mesh_data, verts, faces)
+        lod_obj = bpy.data.objects.new(name=obj_name, object_data=lod_mesh_data)
+        context.collection.objects.link(lod_obj)
+        lod_obj.hide_viewport = lod_obj.hide_render = lod > 0
+        lod_objs[chunk].append(lod_obj)
+    return lod_objs
+
+# Shows one LOD per chunk, chosen by lod_index() from the distance between the chunk's center and center.
+def set_visible_lods(lod_objs, center, lod_distance):
+    for objs in lod_objs.values():
+        co = objs[0].data.vertices
+        verts = np.empty(len(co)*3, dtype=np.float32)
+        co.foreach_get("co", verts)
+        chunk_center = verts.reshape(-1, 3)[:, :2].mean(axis=0)
+        level = lod_index(np.hypot(*(chunk_center - np.asarray(center[:2]))), lod_distance, len(objs))
+        for lod, obj in enumerate(objs):
+            obj.hide_viewport = obj.hide_render = lod != level
+
+#-------------------------------------------------------------------------------------------------------
+
+# Geometry nodes that put an instance of instance_obj on every vertex of points_obj, rotated and scaled by the
+# vertices' 'rotation' (XYZ Euler) and 'scale' attributes, so Blender draws all props from one object.
+def create_instancer_node_tree(points_obj, instance_obj):
+    geo_nodes_mod = points_obj.modifiers.new(name=points_obj.name+"_geo_nodes_mod", type='NODES')
+    node_group = bpy.data.node_groups.new(points_obj.name+"_geo_nodes_mod", 'GeometryNodeTree')
+    geo_nodes_mod.node_group = node_group
+    
+    node_group.interface.new_socket(name="Geometry", in_out="INPUT", socket_type="NodeSocketGeometry")
+    node_group.interface.new_socket(name="Geometry", in_out="OUTPUT", socket_type="NodeSocketGeometry")
+    
+    input_node = node_group.nodes.new('NodeGroupInput')
     
-    verts = gen_random_map(num_pts, h_min, h_max, noise_basis, x, y)
-    bidir_interp(InterpType.Bicubic, verts, row_lines, col_lines, 10)
+    obj_info_node = node_group.nodes.new('GeometryNodeObjectInfo')
+    obj_info_node.inputs['Object'].default_value = instance_obj
+    
+    rotation_node = node_group.nodes.new('GeometryNodeInputNamedAttribute')
+    rotation_node.data_type = 'FLOAT_VECTOR'
+    rotation_node.inputs['Name'].default_value = "rotation"
+    
+    scale_node = node_group.nodes.new('GeometryNodeInputNamedAttribute')
+    scale_node.data_type = 'FLOAT_VECTOR'
+    scale_node.inputs['Name'].default_value = "scale"
+    
+    instance_node = node_group.nodes.new('GeometryNodeInstanceOnPoints')
+    
+    output_node = node_group.nodes.new('NodeGroupOutput')
+    
+    input_node.location = Vector((0, 0))
+    obj_info_node.location = Vector((0, -input_node.width*1.5))
+    rotation_node.location = Vector((0, -input_node.width*3))
+    scale_node.location = Vector((0, -input_node.width*4))
+    instance_node.location = Vector((input_node.width*1.5, 0))
+    output_node.location = Vector((instance_node.location[0]+instance_node.width*1.5, 0))
+    
+    node_group.links.new(input_node.outputs['Geometry'], instance_node.inputs['Points'])
+    node_group.links.new(obj_info_node.outputs['Geometry'], instance_node.inputs['Instance'])
+    node_group.links.new(rotation_node.outputs['Attribute'], instance_node.inputs['Rotation'])
+    node_group.links.new(scale_node.outputs['Attribute'], instance_node.inputs['Scale'])
+    node_group.links.new(instance_node.outputs['Instances'], output_node.inputs['Geometry'])
+    return geo_nodes_mod
 
-    z = verts[:,2]
-    finish_mesh(context, cell_width, origin, elev_type, chop_border, noise_basis, row_lines, col_lines, num_pts, edges, x, y, z, False)
+# One vertex-only object holding the scatter_points() arrays as its vertices and 'rotation', 'scale' and
+# 'surface_normal' point attributes, instancing instance_obj on every vertex.
+def gen_scatter_instances(context, name, positions, normals, rotations, scales, instance_obj):
+    points_mesh_data = bpy.data.meshes.new(name=name+"_points")
+    points_mesh_data.vertices.add(len(positions))
+    points_mesh_data.vertices.foreach_set("co", positions.ravel())
+    for attr_name, values in (("rotation", rotations), ("scale", scales), ("surface_normal", normals)):
+        attr = points_mesh_data.attributes.new(name=attr_name, type='FLOAT_VECTOR', domain='POINT')
+        attr.data.foreach_set("vector", values.ravel())
+    points_mesh_data.update()
     
+    points_obj = bpy.data.objects.new(name=name, object_data=points_mesh_data)
+    context.collection.objects.link(points_obj)
+    create_instancer_node_tree(points_obj, instance_obj)
+    return points_obj
+
+# A four sided pyramid standing on the origin, as a stand-in prop.
+def create_pyramid_obj(context, name, size=1, height=3):
+    verts = [(-size, -size, 0), (size, -size, 0), (size, size, 0), (-size, size, 0), (0, 0, height)]
+    faces = [(3, 2, 1, 0), (0, 1, 4), (1, 2, 4), (2, 3, 4), (3, 0, 4)]
+    pyramid_mesh_data = bpy.data.meshes.new(name=name+"_mesh")
+    pyramid_mesh_data.from_pydata(verts, [], faces)
+    pyramid_mesh_data.update(calc_edges=True)
+    pyramid_obj = bpy.data.objects.new(name=name, object_data=pyramid_mesh_data)
+    context.collection.objects.link(pyramid_obj)
+    return pyramid_obj
+
+#-------------------------------------------------------------------------------------------------------
+
+def tile_obj_name(stream, tx, ty):
+    return stream.elev_type+"_tile_"+str(tx)+"_"+str(ty)
+
+def gen_tile_mesh(context, stream, tx, ty, cell_width, z_origin=0):
+    z = stream.tile(tx, ty)
+    row_lines, col_lines, num_pts, faces, x, y = grid_topology(stream.tile_size, stream.tile_size, stream.elev_type)
+    x0, y0 = stream.tile_origin(tx, ty)
+    verts = grid_verts(cell_width, (x0*cell_width, y0*cell_width, z_origin), num_pts, x, y, z.ravel())
+
+    name = tile_obj_name(stream, tx, ty)
+    tile_mesh_data = bpy.data.meshes.new(name=name+"_mesh")
+    fill_grid_mesh(tile_mesh_data, verts, faces)
+    tile_obj = bpy.data.objects.new(name=name, object_data=tile_mesh_data)
+    context.collection.objects.link(tile_obj)
+    return tile_obj
+
+# Keeps tile meshes for the tiles within radius of world position center (e.g. the camera location) in the scene,
+# building the ones that came into range and removing the ones that left it.
+def stream_tile_meshes(context, stream, center, cell_width, radius=1, z_origin=0):
+    wanted = stream.tiles_around(center[0]/cell_width, center[1]/cell_width, radius)
+    wanted_names = {tile_obj_name(stream, tx, ty):(tx, ty) for tx, ty in wanted.keys()}
+    prefix = stream.elev_type+"_tile_"
+    
+    for obj in [o for o in bpy.data.objects if o.name.startswith(prefix) and o.name not in wanted_names]:
+        remove_mesh_obj(obj)
+        
+    for name, (tx, ty) in wanted_names.items():
+        if name not in bpy.data.objects:
+            gen_tile_mesh(context, stream, tx, ty, cell_width, z_origin)
+
+def test_tile_streaming(y, tile_w):
+    spacing = tile_w+5
+    y += spacing
+    for i, elev_type in enumerate([ElevType.Random, ElevType.HybridMultiFractal, ElevType.BlenderMultiFractal, \
+        ElevType.BlenderHeteroTerrain]):
+        stream = TerrainTileStream(elev_type, tile_size=tile_w//2, seed=7, noise_basis='PERLIN_NEW', z_scale=15)
+        for ty in range(2):
+            for tx in range(2):
+                gen_tile_mesh(bpy.context, stream, tx, ty, cell_width=1, z_origin=1).location = (spacing*i, y, 0)
+    return y
+
 def test_random_fbm_ds():
-    gen_random_mesh(bpy.context, rows=120, cols=120, cell_width=1, origin=(0,0,1), noise_basis='UNIFORM', unit_size=5, h_min=-50, h_max=50, chop_border=True)
-    gen_random_fbm_mesh(bpy.context, rows=120, cols=120, cell_width=1, origin=(125,0,1), noise_basis='UNIFORM', unit_size=5, h_min=-50, h_max=50, num_octaves=3, chop_border=True)
-    gen_random_fbm_mesh(bpy.context, rows=120, cols=120, cell_width=1, origin=(250,0,1), noise_basis='UNIFORM', unit_size=5, h_min=-50, h_max=50, num_octaves=4, chop_border=True)
-    gen_ds_mesh(bpy.context, rows=100, cols=100, cell_width=1, origin=(375,0,1), h_min=-50, h_max=50, unit_size=5, chop_border=True)
+    gen_random_mesh(bpy.context, rows=120, cols=120, cell_width=1, origin=(0,0,1), noise_basis='UNIFORM', unit_size=5, h_min=-50, h_max=50, chop_border=True, seed=100)
+    gen_random_fbm_mesh(bpy.context, rows=120, cols=120, cell_width=1, origin=(125,0,1), noise_basis='UNIFORM', unit_size=5, h_min=-50, h_max=50, num_octaves=3, chop_border=True, seed=101)
+    gen_random_fbm_mesh(bpy.context, rows=120, cols=120, cell_width=1, origin=(250,0,1), noise_basis='UNIFORM', unit_size=5, h_min=-50, h_max=50, num_octaves=4, chop_border=True, seed=102)
+    gen_ds_mesh(bpy.context, rows=100, cols=100, cell_width=1, origin=(375,0,1), h_min=-50, h_max=50, unit_size=5, chop_border=True, seed=103)
     
     y = 135
     for i in range(len(bl_noise_basis_options)):
@@ -409,13 +643,114 @@ def test_bl_fractal_functions(y, tile_w):
             
     return y
     
+def test_spectral(y, tile_w):
+    spacing = tile_w+5
+    y += spacing
+    for i, beta in enumerate([1.8, 2.0, 2.2, 2.4, 2.6, 2.8, 3.0]):
+        gen_spectral_mesh(bpy.context, rows=tile_w, cols=tile_w, cell_width=1, origin=(spacing*i,y,1), beta=beta, \
+            h_min=-15, h_max=15, seed=i)
+    gen_spectral_mesh(bpy.context, rows=tile_w, cols=tile_w, cell_width=1, origin=(spacing*7,y,1), beta=2.4, \
+        h_min=-15, h_max=15, seed=7, periodic=True, chop_border=False)
+    return y
+
+# Pairs of meshes from the same heights, without and with erosion.
+def test_erosion(y, tile_w):
+    spacing = tile_w+5
+    y += spacing
+    for i, erosion in enumerate([None, {'hydraulic_iterations':80, 'thermal_iterations':20}]):
+        gen_ds_mesh(bpy.context, rows=tile_w, cols=tile_w, cell_width=1, origin=(spacing*i,y,1), h_min=-50, h_max=50, unit_size=5, \
+            erosion=erosion, seed=100)
+        gen_hybrid_multi_fractal_mesh(bpy.context, rows=tile_w, cols=tile_w, cell_width=1, origin=(spacing*(i+2),y,1), \
+            chop_border=True, noise_basis='PERLIN_NEW', z_scale=15, erosion=erosion)
+        gen_spectral_mesh(bpy.context, rows=tile_w, cols=tile_w, cell_width=1, origin=(spacing*(i+4),y,1), beta=2.2, \
+            h_min=-15, h_max=15, seed=3, erosion=erosion)
+    return y
+
+# The same diamond-square and UNIFORM fbm heights smoothed by the DECIMATE/SUBSURF modifiers, then by height filters.
+def test_filters(y, tile_w):
+    spacing = tile_w+5
+    y += spacing
+    filter_sets = [None, [{'type':'gaussian', 'sigma':2}], [{'type':'box', 'radius':2}], \
+        [{'type':'bilateral', 'sigma':2, 'sigma_range':15}], \
+        [{'type':'bilateral', 'sigma':2, 'sigma_range':15}, {'type':'unsharp', 'sigma':3, 'amount':0.5}]]
+    for i, filters in enumerate(filter_sets):
+        gen_ds_mesh(bpy.context, rows=tile_w, cols=tile_w, cell_width=1, origin=(spacing*i,y,1), h_min=-50, h_max=50, unit_size=5, \
+            seed=100, filters=filters)
+        gen_random_fbm_mesh(bpy.context, rows=tile_w, cols=tile_w, cell_width=1, origin=(spacing*i,y+spacing,1), noise_basis='UNIFORM', \
+            unit_size=5, h_min=-50, h_max=50, num_octaves=4, seed=101, filters=filters)
+    return y + spacing
+
+# Refines from timers after the script returns.
+def test_progressive_preview(y, tile_w):
+    spacing = tile_w+5
+    y += spacing
+    for i, elev_type in enumerate([ElevType.HybridMultiFractal, ElevType.BlenderMultiFractal, ElevType.BlenderHeteroTerrain]):
+        gen_preview_fractal_mesh(bpy.context, rows=tile_w, cols=tile_w, cell_width=1, origin=(spacing*i,y,1), elev_type=elev_type, \
+            noise_basis='PERLIN_NEW', z_scale=(15, 10, 1)[i])
+    return y
+
+# Chunked LODs of a hybrid multi fractal heightmap, with finer chunks towards the near corner.
+def test_lod_chain(y, tile_w):
+    spacing = tile_w+5
+    y += spacing
+    rows = cols = 2*tile_w
+    row_lines, col_lines, num_pts, faces, x, yy = grid_topology(rows, cols, ElevType.HybridMultiFractal)
+    z = cached_height_map(height_cache, 'hybrid_multi_fractal', dict(rows=rows, cols=cols, noise_basis='PERLIN_NEW', z_scale=15))
+    z = finish_height_map(z, row_lines, col_lines, ElevType.HybridMultiFractal)
+    lod_objs = gen_lod_meshes(bpy.context, "hmf_lod", z, row_lines, col_lines, cell_width=1, origin=(0,y,1), chunk_size=32)
+    set_visible_lods(lod_objs, (0, y), lod_distance=40)
+    return y + rows
+
+# Props scattered on the flatter parts of a spectral terrain, and aligned to the surface on a second one.
+def test_scatter(y, tile_w):
+    spacing = tile_w+5
+    y += spacing
+    prop_obj = create_pyramid_obj(bpy.context, "scatter_prop", size=0.5, height=2)
+    prop_obj.location = (-spacing, y, 0)
+    row_lines, col_lines, num_pts, faces, x, yy = grid_topology(tile_w, tile_w, ElevType.Spectral)
+    z = cached_height_map(height_cache, 'spectral', dict(rows=tile_w, cols=tile_w, beta=2.4, h_min=-15, h_max=15, seed=11))
+    z = finish_height_map(z, row_lines, col_lines, ElevType.Spectral)
+    for i, align in enumerate([False, True]):
+        origin = (spacing*i, y, 1)
+        grid_mesh_obj = create_mesh_obj(bpy.context, ElevType.Spectral, "scatter_"+str(i), \
+            grid_verts(1, origin, num_pts, x, yy, z), faces)
+        add_modifiers(True, grid_mesh_obj)
+        positions, normals, rotations, scales = scatter_points(z, row_lines, col_lines, radius=2, cell_width=1, origin=origin, \
+            slope_range=(0, 35), height_range=(-10, 12), align=align, scale_range=(0.6, 1.4), seed=i)
+        gen_scatter_instances(bpy.context, "scatter_points_"+str(i), positions, normals, rotations, scales, prop_obj)
+    return y
+
+# Terrains generated in the background, two in worker processes and one stage by stage in Blender's own process, which
+# blocks Blender during each stage. The meshes appear once the timers have collected their heights, after the script
+# has returned.
+def test_async_terrain(y, tile_w):
+    spacing = tile_w+5
+    y += spacing
+    def print_progress(job):
+        print(job.name + ": " + str(job.stage) + ", " + str(round(job.progress*100)) + "%")
+    gen_terrain_async(bpy.context, "async_ds", 'diamond_square', dict(rows=tile_w, cols=tile_w, h_min=-50, h_max=50, unit_size=5), \
+        origin=(0,y,1), seed=100, filters=[{'type':'bilateral', 'sigma':2, 'sigma_range':15}], on_progress=print_progress)
+    gen_terrain_async(bpy.context, "async_hmf", 'hybrid_multi_fractal', dict(rows=tile_w, cols=tile_w, noise_basis='PERLIN_NEW'), \
+        origin=(spacing,y,1), z_scale=15, on_progress=print_progress)
+    gen_terrain_async(bpy.context, "async_spectral", 'spectral', dict(rows=tile_w, cols=tile_w, beta=2.2, h_min=-15, h_max=15), \
+        origin=(2*spacing,y,1), seed=5, in_process=True, on_progress=print_progress)
+    return y
+
 if __name__ == "__main__":
     start = timeit.default_timer()
     
-    np.random.seed(100)
+    height_cache = HeightMapCache(os.path.join(tempfile.gettempdir(), "ch6_height_cache"), 512*1024*1024)
     y = test_random_fbm_ds()
     y = test_hybrid_multi_fractal(y, 100)
-    test_bl_fractal_functions(y, 100)
+    y = test_bl_fractal_functions(y, 100)
+    y = test_tile_streaming(y, 100)
+    y = test_spectral(y, 100)
+    y = test_erosion(y, 100)
+    y = test_filters(y, 100)
+    y = test_progressive_preview(y, 100)
+    y = test_lod_chain(y, 100)
+    y = test_scatter(y, 100)
+    test_async_terrain(y, 100)
             
     stop = timeit.default_timer()
     print("Gen all test models runime: ", stop - start)
@@ -0,0 +1,102 @@
+import numpy as np
+
+import hashlib
+import json
+import os
+
+from terrain_core import height_map_funcs
+
+__all__ = (
+    "GENERATOR_VERSION",
+    "cache_key",
+    "is_deterministic",
+    "HeightMapCache",
+    "cached_height_map"
+    )
+
+# Part of every cache key. Bump it whenever a change to the height math changes the heights for the same
+# parameters, so stale entries are never returned.
+GENERATOR_VERSION = 2
+
+# Parameters that only change how the heights are computed, not the heights themselves.
+UNKEYED_PARAMS = ('num_workers', 'mp_context')
+
+# Every generator draws its random numbers from its seed parameter (default 0), so its heights follow from its
+# parameters, except for a seed passed as a np.random.Generator or SeedSequence, whose state a key cannot capture.
+def is_deterministic(generator, params):
+    return not isinstance(params.get('seed'), (np.random.Generator, np.random.SeedSequence))
+
+# Content address of a heightmap: a SHA-256 of the generator name, its canonical (sorted, JSON) parameters and
+# GENERATOR_VERSION.
+def cache_key(generator, params):
+    keyed = {k:v for k, v in params.items() if k not in UNKEYED_PARAMS}
+    spec = json.dumps([GENERATOR_VERSION, generator, keyed], sort_keys=True, default=str)
+    return hashlib.sha256(spec.encode()).hexdigest()
+
+# Heightmaps stored as .npy files named by their key in cache_dir, float32 by default, which halves their size and
+# keeps the precision of the float32 mesh vertices. A hit touches the file's modification time, and once the
+# files take more than max_bytes, the least recently used ones are deleted. Files are written to a temporary name
+# and renamed, so concurrent readers never see a partial entry.
+class HeightMapCache:
+    def __init__(self, cache_dir, max_bytes=1024*1024*1024, dtype=np.float32):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.dtype = dtype
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ".npy")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            z = np.load(path)
+        except (FileNotFoundError, ValueError, EOFError):
+            return None
+        os.utime(path)
+        return z
+
+    def put(self, key, z):
+        path = self.path(key)
+        tmp_path = path + "." + str(os.getpid()) + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.asarray(z, dtype=self.dtype))
+        os.replace(tmp_path, path)
+        self.evict(keep=path)
+
+    def entries(self):
+        return [e for e in os.scandir(self.cache_dir) if e.is_file() and e.name.endswith(".npy")]
+
+    def evict(self, keep=None):
+        entries = sorted(self.entries(), key=lambda e: e.stat().st_mtime)
+        total = sum(e.stat().st_size for e in entries)
+        for e in entries:
+            if total <= self.max_bytes:
+                break
+            if e.path == keep:
+                continue
+            total -= e.stat().st_size
+            try:
+                os.remove(e.path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        for e in self.entries():
+            os.remove(e.path)
+
+# The heights of height_map_funcs[generator] for params (keyword arguments of its *_height_map() function), from
+# cache if it holds them. cache may be None. With a cache, the heights always come back as the cache's dtype, as
+# stored, whether they were a hit or not.
+def cached_height_map(cache, generator, params):
+    height_map_fn = height_map_funcs[generator][0]
+    if cache is None or not is_deterministic(generator, params):
+        return height_map_fn(**params)
+
+    key = cache_key(generator, params)
+    z = cache.get(key)
+    if z is None:
+        z = height_map_fn(**params)
+        cache.put(key, z)
+        z = np.asarray(z, dtype=cache.dtype)
+    return z
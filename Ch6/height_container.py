@@ -0,0 +1,137 @@
+import numpy as np
+
+import struct
+import zlib
+
+__all__ = (
+    "CONTAINER_MAGIC",
+    "CONTAINER_CHUNK",
+    "container_levels",
+    "write_height_container",
+    "HeightContainer"
+    )
+
+# Layout of a height container (.thc), all little-endian:
+#
+#   header   magic, version, num_levels, rows, cols, chunk_size
+#   index    per level, per chunk row, per chunk col: data offset, data bytes, height offset, height scale
+#   data     zlib streams of uint16 chunks
+#
+# Level 0 is the full row x col heightmap and level k keeps every 2^k-th row and column of it, starting with the first,
+# like the LOD strides. A level contains the map's last row (column) only if rows-1 (cols-1) is a multiple of 2^k, as
+# for 2^n+1 maps. Each level is cut into chunk_size x chunk_size blocks of samples (the last row and column of blocks
+# may be smaller). A block stores round((z - offset)/scale) as uint16, with offset and scale from its own height
+# range, so the error is at most scale/2 and flat blocks keep a finer step than the range of the whole map would
+# give. Each row of a block is delta coded before compression. The index lets a reader seek to any block of any level
+# and inflate only that one.
+CONTAINER_MAGIC = b'CH6H'
+CONTAINER_VERSION = 1
+HEADER = struct.Struct("<4sHHIII")
+INDEX_ENTRY = struct.Struct("<QIdd")
+
+# Samples per chunk side.
+CONTAINER_CHUNK = 256
+
+# Number of mip levels down to the first that fits in one chunk.
+def container_levels(rows, cols, chunk_size=CONTAINER_CHUNK):
+    num_levels = 1
+    while max(rows, cols) > chunk_size:
+        rows, cols = (rows+1)//2, (cols+1)//2
+        num_levels += 1
+    return num_levels
+
+def level_shape(rows, cols, level):
+    step = 2**level
+    return (rows+step-1)//step, (cols+step-1)//step
+
+def chunk_grid(shape, chunk_size):
+    return (shape[0]+chunk_size-1)//chunk_size, (shape[1]+chunk_size-1)//chunk_size
+
+def encode_chunk(block, compress_level):
+    z_min, z_max = float(np.min(block)), float(np.max(block))
+    scale = (z_max - z_min)/65535 if z_max > z_min else 1.0
+    q = np.rint((block - z_min)/scale).astype(np.uint16)
+    q[:, 1:] = np.diff(q, axis=1)
+    return zlib.compress(q.astype('<u2').tobytes(), compress_level), z_min, scale
+
+def decode_chunk(data, shape, z_offset, z_scale):
+    q = np.frombuffer(zlib.decompress(data), dtype='<u2').reshape(shape)
+    q = np.cumsum(q, axis=1, dtype=np.uint16)
+    return (q*z_scale + z_offset).astype(np.float32)
+
+# Writes the row_lines x col_lines heights z (a 2D array, e.g. a memory-mapped .npy, or the flat z of a *_height_map()
+# function) to a height container, one chunk at a time. num_levels None builds levels down to a single chunk.
+def write_height_container(path, z, row_lines=None, col_lines=None, chunk_size=CONTAINER_CHUNK, num_levels=None, \
+    compress_level=6):
+    if row_lines is not None:
+        z = np.reshape(z, (row_lines, col_lines))
+    rows, cols = z.shape
+    if num_levels is None:
+        num_levels = container_levels(rows, cols, chunk_size)
+
+    grids = [chunk_grid(level_shape(rows, cols, level), chunk_size) for level in range(num_levels)]
+    num_chunks = sum(g[0]*g[1] for g in grids)
+    index = []
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(CONTAINER_MAGIC, CONTAINER_VERSION, num_levels, rows, cols, chunk_size))
+        f.write(bytes(num_chunks*INDEX_ENTRY.size))
+        for level, (grid_rows, grid_cols) in enumerate(grids):
+            z_level = z[::2**level, ::2**level]
+            for ci in range(grid_rows):
+                for cj in range(grid_cols):
+                    block = z_level[ci*chunk_size:(ci+1)*chunk_size, cj*chunk_size:(cj+1)*chunk_size]
+                    data, z_offset, z_scale = encode_chunk(np.asarray(block, dtype=np.float64), compress_level)
+                    index.append(INDEX_ENTRY.pack(f.tell(), len(data), z_offset, z_scale))
+                    f.write(data)
+        f.seek(HEADER.size)
+        f.write(b''.join(index))
+
+# Random access reader of a height container. Only the header and index are read on open; read_chunk() reads and
+# inflates a single chunk, and read_level() assembles a whole level, e.g. a coarse level for an overview. Heights
+# are returned as float32.
+class HeightContainer:
+    def __init__(self, path):
+        self.f = open(path, 'rb')
+        magic, version, self.num_levels, self.rows, self.cols, self.chunk_size = HEADER.unpack(self.f.read(HEADER.size))
+        if magic != CONTAINER_MAGIC or version != CONTAINER_VERSION:
+            self.f.close()
+            raise ValueError(path + " is not a version " + str(CONTAINER_VERSION) + " height container")
+        self.grids = [chunk_grid(self.level_shape(level), self.chunk_size) for level in range(self.num_levels)]
+        num_chunks = sum(g[0]*g[1] for g in self.grids)
+        self.index = list(INDEX_ENTRY.iter_unpack(self.f.read(num_chunks*INDEX_ENTRY.size)))
+        self.level_starts = np.cumsum([0] + [g[0]*g[1] for g in self.grids])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.f.close()
+
+    def level_shape(self, level):
+        return level_shape(self.rows, self.cols, level)
+
+    # Shape of chunk (ci, cj) of a level, smaller than chunk_size x chunk_size in the last chunk row and column.
+    def chunk_shape(self, level, ci, cj):
+        rows, cols = self.level_shape(level)
+        return min(self.chunk_size, rows - ci*self.chunk_size), min(self.chunk_size, cols - cj*self.chunk_size)
+
+    def read_chunk(self, level, ci, cj):
+        grid_rows, grid_cols = self.grids[level]
+        if not (0 <= ci < grid_rows and 0 <= cj < grid_cols):
+            raise IndexError("Chunk " + str((ci, cj)) + " outside the " + str(grid_rows) + "x" + str(grid_cols) + \
+                " chunks of level " + str(level))
+        offset, nbytes, z_offset, z_scale = self.index[self.level_starts[level] + ci*grid_cols + cj]
+        self.f.seek(offset)
+        return decode_chunk(self.f.read(nbytes), self.chunk_shape(level, ci, cj), z_offset, z_scale)
+
+    def read_level(self, level):
+        z = np.empty(self.level_shape(level), dtype=np.float32)
+        grid_rows, grid_cols = self.grids[level]
+        for ci in range(grid_rows):
+            for cj in range(grid_cols):
+                z[ci*self.chunk_size:(ci+1)*self.chunk_size, cj*self.chunk_size:(cj+1)*self.chunk_size] = \
+                    self.read_chunk(level, ci, cj)
+        return z
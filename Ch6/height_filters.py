@@ -0,0 +1,184 @@
+import numpy as np
+
+from enum import Enum
+from math import ceil
+
+__all__ = (
+    "FilterType",
+    "gaussian_kernel",
+    "box_filter",
+    "gaussian_filter",
+    "bilateral_filter",
+    "unsharp_mask",
+    "filter_heights"
+    )
+
+class FilterType(str, Enum):
+    Box = 'box'
+    Gaussian = 'gaussian'
+    Bilateral = 'bilateral'
+    Unsharp = 'unsharp'
+
+# Size of the float32 work buffer of a band of rows. Filters run band by band so that every pass over a band stays in
+# the CPU cache instead of streaming the whole grid through memory once per kernel tap. Bands are at least 4 times
+# as tall as their padding, so that copying the padding rows stays cheap for wide kernels.
+FILTER_BAND_BYTES = 256*1024
+
+# Cap on the squared height differences of bilateral_taps(), in its units. Larger differences get the same range
+# weight, under 1e-13, which makes no difference to the result, while exp() of a larger argument would underflow into
+# float32's subnormal range, where it is several times slower. Without the cap, rough heights filtered more than twice
+# as slowly as smooth ones.
+MAX_RANGE_EXPONENT = np.float32(30)
+
+#------------------------------------------------------------------------------------------------------------------
+
+# Rows r0 - pad to r1 + pad of the 2D heights z2, with pad columns on either side, as a float32 work buffer. Rows and
+# columns past the edges repeat the edge heights, so filters keep the level of the terrain's borders.
+def padded_band(z2, r0, r1, pad):
+    rows, cols = z2.shape
+    buf = np.empty((r1-r0+2*pad, cols+2*pad), dtype=np.float32)
+    lo, hi = max(r0-pad, 0), min(r1+pad, rows)
+    top = lo-(r0-pad)
+    buf[top:top+hi-lo, pad:pad+cols] = z2[lo:hi]
+    buf[:top] = buf[top]
+    buf[top+hi-lo:] = buf[top+hi-lo-1]
+    buf[:, :pad] = buf[:, pad:pad+1]
+    buf[:, pad+cols:] = buf[:, pad+cols-1:pad+cols]
+    return buf
+
+# Applies band_fn(buf, num_rows, cols) to each band of rows of z2, where buf is the padded_band() of the band, and
+# returns the (rows, cols) results in a new array of z2's float dtype.
+def banded_filter(z2, pad, band_fn):
+    rows, cols = z2.shape
+    out = np.empty(z2.shape, dtype=np.result_type(z2.dtype, np.float32))
+    band_rows = max(4*pad, FILTER_BAND_BYTES//(4*(cols+2*pad)))
+    for r0 in range(0, rows, band_rows):
+        r1 = min(r0+band_rows, rows)
+        out[r0:r1] = band_fn(padded_band(z2, r0, r1, pad), r1-r0, cols)
+    return out
+
+# The n values of a padded buffer that are shifted by offset along axis (0 rows, 1 columns), where offset pad is the
+# unshifted center.
+def shifted(buf, offset, n, axis):
+    return buf[offset:offset+n] if axis == 0 else buf[:, offset:offset+n]
+
+# Normalized weights of a Gaussian of standard deviation sigma for offsets 0..radius (the kernel is symmetric).
+def gaussian_kernel(sigma, truncate=3):
+    radius = max(1, ceil(truncate*sigma))
+    w = np.exp(-np.arange(radius+1)**2/(2*sigma*sigma))
+    return (w/(w[0] + 2*np.sum(w[1:]))).astype(np.float32)
+
+# Convolution of a padded buffer with the symmetric half kernel w along axis, for the n values around its center.
+# Pairs of taps at -j and +j share their weight, so each pair costs one add and one multiply-add.
+def symmetric_taps(buf, w, n, axis):
+    pad = len(w)-1
+    acc = shifted(buf, pad, n, axis)*w[0]
+    pair = np.empty_like(acc)
+    for j in range(1, pad+1):
+        np.add(shifted(buf, pad-j, n, axis), shifted(buf, pad+j, n, axis), out=pair)
+        pair *= w[j]
+        acc += pair
+    return acc
+
+def gaussian_band(buf, w, n, cols):
+    return symmetric_taps(symmetric_taps(buf, w, n, 0), w, cols, 1)
+
+# Sums of the size consecutive values from each of the n positions of buf along axis, from running sums of 1, 2, 4,
+# ... values: a window of size is the sum of the runs of its binary digits, so it takes about 2*log2(size) adds of
+# whole arrays instead of size. Unlike a cumsum, every value is a sum of at most size heights, so float32 keeps their
+# precision.
+def window_sums(buf, size, n, axis):
+    total = None
+    offset = 0
+    runs = buf
+    run = 1
+    while True:
+        if size & run:
+            part = shifted(runs, offset, n, axis)
+            total = part.copy() if total is None else np.add(total, part, out=total)
+            offset += run
+        if 2*run > size:
+            return total
+        m = runs.shape[axis]-run
+        runs = shifted(runs, 0, m, axis) + shifted(runs, run, m, axis)
+        run *= 2
+
+# Moving average over (2*radius+1)^2 cells, with a cost that grows only with the log of the radius.
+def box_filter(z2, radius=2):
+    size = 2*radius+1
+    def box_band(buf, n, cols):
+        box = window_sums(window_sums(buf, size, n, 0), size, cols, 1)
+        box *= np.float32(1/(size*size))
+        return box
+    return banded_filter(z2, radius, box_band)
+
+# Separable Gaussian blur with standard deviation sigma (cells), cut off at truncate*sigma.
+def gaussian_filter(z2, sigma=1.5, truncate=3):
+    w = gaussian_kernel(sigma, truncate)
+    return banded_filter(z2, len(w)-1, lambda buf, n, cols: gaussian_band(buf, w, n, cols))
+
+# One pass of a 1D bilateral filter along axis, on heights in units of sqrt(2)*sigma_range so that the range weight
+# of a height difference d is exp(-d*d). The weight of the pair of cells j apart is the same seen from either cell,
+# so one exp per cell and offset serves both the -j and +j taps, and the result is accumulated as the center height
+# plus the weighted mean of the differences, which are already at hand.
+def bilateral_taps(buf, log_w, n, axis):
+    pad = len(log_w)-1
+    num = np.zeros_like(shifted(buf, pad, n, axis))
+    den = np.ones_like(num)
+    for j in range(1, pad+1):
+        # Entry i of d and pair_w belongs to the cells at pad-j+i and pad+i along axis.
+        d = shifted(buf, pad, n+j, axis) - shifted(buf, pad-j, n+j, axis)
+        pair_w = d*d
+        np.minimum(pair_w, MAX_RANGE_EXPONENT, out=pair_w)
+        np.subtract(log_w[j], pair_w, out=pair_w)
+        np.exp(pair_w, out=pair_w)
+        d *= pair_w
+        num += shifted(d, j, n, axis)
+        num -= shifted(d, 0, n, axis)
+        den += shifted(pair_w, 0, n, axis)
+        den += shifted(pair_w, j, n, axis)
+    num /= den
+    num += shifted(buf, pad, n, axis)
+    return num
+
+# Edge-preserving smoothing: a Gaussian of sigma (cells) in space, weighted by a Gaussian of sigma_range on the
+# height difference, so ridges and cliffs steeper than about sigma_range stay sharp while small noise is averaged.
+# Applied separably, rows then columns, which approximates the full 2D filter at a fraction of its exps. The spatial
+# kernel is cut off at 2 sigma by default, where the range weights already dominate.
+def bilateral_filter(z2, sigma=1.5, sigma_range=5, truncate=2):
+    w = gaussian_kernel(sigma, truncate)
+    log_w = np.log(w/w[0])
+    scale = np.float32(np.sqrt(0.5)/sigma_range)
+    def bilateral_band(buf, n, cols):
+        buf *= scale
+        z_band = bilateral_taps(bilateral_taps(buf, log_w, n, 0), log_w, cols, 1)
+        z_band /= scale
+        return z_band
+    return banded_filter(z2, len(w)-1, bilateral_band)
+
+# Sharpening: z + amount*(z - gaussian_filter(z, sigma)), which steepens features around sigma cells wide.
+def unsharp_mask(z2, sigma=1.5, amount=1, truncate=3):
+    w = gaussian_kernel(sigma, truncate)
+    pad = len(w)-1
+    def unsharp_band(buf, n, cols):
+        center = buf[pad:pad+n, pad:pad+cols]
+        return center + (center - gaussian_band(buf, w, n, cols))*np.float32(amount)
+    return banded_filter(z2, pad, unsharp_band)
+
+# Filters the heights z of a row_lines x col_lines grid (flat, as built by the gen_*_mesh functions) with each filter
+# of filters in turn, e.g. [{'type':'bilateral', 'sigma':2, 'sigma_range':8}, {'type':'unsharp', 'amount':0.5}]. Each
+# dict has a FilterType 'type' plus any keyword arguments of that filter's function. Returns new flat float64 heights.
+def filter_heights(z, row_lines, col_lines, filters):
+    z2 = np.reshape(z, (row_lines, col_lines))
+    for f in filters:
+        params = {k:v for k, v in f.items() if k != 'type'}
+        match FilterType(f['type']):
+            case FilterType.Box:
+                z2 = box_filter(z2, **params)
+            case FilterType.Gaussian:
+                z2 = gaussian_filter(z2, **params)
+            case FilterType.Bilateral:
+                z2 = bilateral_filter(z2, **params)
+            case FilterType.Unsharp:
+                z2 = unsharp_mask(z2, **params)
+    return np.asarray(z2, dtype=np.float64).ravel()
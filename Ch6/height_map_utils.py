@@ -0,0 +1,366 @@
+import numpy as np
+
+from collections import OrderedDict
+from enum import Enum, unique
+from math import ceil, log2, pow
+import timeit
+
+__all__ = (
+    "ElevType",
+    "InterpType",
+    "spawn_seeds",
+    "spawn_rngs",
+    "cubic",
+    "lattice_lines",
+    "catmull_rom_axis",
+    "upsample_lattice",
+    "interp_heights",
+    "bidir_interp",
+    "bidir_interp_loop",
+    "bench_bidir_interp",
+    "diamond_square_levels",
+    "spectral_heights",
+    "grid_quad_faces",
+    "grid_topology",
+    "quad_loop_starts"
+    )
+
+@unique
+class ElevType(str, Enum):
+    Random = "random"
+    DiamondSquare = "diamond_square"
+    HybridMultiFractal = "hybrid_multi_fractal"
+    BlenderMultiFractal = "blender_multi_fractal"
+    BlenderHeteroTerrain = "blender_hetero_terrain"
+    Spectral = "spectral"
+
+@unique
+class InterpType(str, Enum):
+    Bilinear = "bilinear"
+    Bicubic = "bicubic"
+    CatmullRom = "catmull_rom"
+
+#------------------------------------------------------------------------------------------------------------------
+
+# Random streams. Wherever Ch6 draws random numbers it takes a seed that is an int, a np.random.SeedSequence or a
+# np.random.Generator, and gives every tile, band, octave or level its own child stream spawned from it. A child
+# only depends on the seed and its position in the spawn order, never on how much an earlier stream drew, so
+# results do not depend on call order, the number of workers or what came from cache.
+def spawn_seeds(seed, n):
+    if isinstance(seed, np.random.Generator):
+        seed = seed.bit_generator.seed_seq
+    elif not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return seed.spawn(n)
+
+def spawn_rngs(seed, n):
+    return [np.random.default_rng(seed_seq) for seed_seq in spawn_seeds(seed, n)]
+
+#------------------------------------------------------------------------------------------------------------------
+
+def cubic(x):
+    return -2*pow(x, 3) + 3*pow(x, 2)
+
+# The weights only vary along one axis, so they are evaluated with cubic() itself to stay bit-identical to the loop.
+def cubic_array(x):
+    return np.fromiter((cubic(v) for v in x), dtype=np.float64, count=len(x))
+
+# Grid lines that carry control samples: every step_size-th line, plus the last line, which the interpolation clamps to.
+def lattice_lines(n_lines, step_size):
+    lines = np.arange(0, n_lines, step_size)
+    if lines[-1] != n_lines-1:
+        lines = np.append(lines, n_lines-1)
+    return lines
+
+def axis_lattice_terms(n_lines, step_size):
+    lines = lattice_lines(n_lines, step_size)
+    idx = np.arange(n_lines)
+    k_sm = idx//step_size
+    k_lg = np.minimum(k_sm+1, len(lines)-1)
+    k_cls = np.where(idx%step_size <= step_size/2, k_sm, k_lg)
+    w_sm = 1-((idx-lines[k_sm])/step_size)
+    w_lg = 1-((lines[k_lg]-idx)/step_size)
+    return lines, k_sm, k_lg, k_cls, w_sm, w_lg
+
+#------------------------------------------------------------------------------------------------------------------
+
+# Evaluates the Catmull-Rom spline through the lattice samples along one axis at the given grid positions.
+def catmull_rom_axis(lat, idx, lines, axis):
+    n = len(lines)
+    if n < 2:
+        return np.repeat(np.take(lat, [0], axis=axis), len(idx), axis=axis)
+    k = np.clip(np.searchsorted(lines, idx, side='right')-1, 0, n-2)
+    t = (idx-lines[k])/(lines[k+1]-lines[k])
+    t2 = t*t
+    t3 = t2*t
+    weights = [0.5*(-t + 2*t2 - t3), 0.5*(2 - 5*t2 + 3*t3), 0.5*(t + 4*t2 - 3*t3), 0.5*(t3 - t2)]
+    out = 0
+    for j in range(4):
+        k_j = np.clip(k+j-1, 0, n-1)
+        w_j = weights[j] if axis == 1 else weights[j][:, None]
+        out = out + w_j*np.take(lat, k_j, axis=axis)
+    return out
+
+# Evaluates the original per-vertex formula for a block of output rows/cols at once. The original loop writes its
+# result back into the grid it reads from, so a control sample on the clamped last lattice row/col may already hold
+# its interpolated value when a later vertex reads it. When lat_written is given, reads of samples that come before
+# the output vertex in row-major order are taken from lat_written, which reproduces that behavior exactly.
+def legacy_interp_block(interp_type, lat, lat_written, rt, ct, row_ids, col_ids):
+    r_lines, r_sm, r_lg, r_cls, dr_s, dr_l = [a[row_ids] if i > 0 else a for i, a in enumerate(rt)]
+    c_lines, c_sm, c_lg, c_cls, dc_s, dc_l = [a[col_ids] if i > 0 else a for i, a in enumerate(ct)]
+    rows = row_ids[:, None]
+    cols = col_ids[None, :]
+
+    def read(kr, kc):
+        if lat_written is None:
+            return lat[kr, kc]
+        pr = r_lines[kr]
+        before = (pr < rows) | ((pr == rows) & (c_lines[kc] < cols))
+        return np.where(before, lat_written[kr, kc], lat[kr, kc])
+
+    if interp_type == InterpType.Bicubic:
+        dc_s, dc_l, dr_s, dr_l = cubic_array(dc_s), cubic_array(dc_l), cubic_array(dr_s), cubic_array(dr_l)
+
+    h_itrp = dc_s[None, :]*read(r_cls[:, None], c_sm[None, :]) + dc_l[None, :]*read(r_cls[:, None], c_lg[None, :])
+    v_itrp = dr_s[:, None]*read(r_sm[:, None], c_cls[None, :]) + dr_l[:, None]*read(r_lg[:, None], c_cls[None, :])
+    return (h_itrp+v_itrp)*0.5
+
+def legacy_written_lattice(interp_type, lat, rt, ct, step_size):
+    r_lines, c_lines = rt[0], ct[0]
+    row_lines, col_lines = r_lines[-1]+1, c_lines[-1]+1
+    # Only samples whose larger neighbor was clamped to the last line end up with a value different from the input.
+    r_changed = np.nonzero(r_lines+step_size > row_lines-1)[0]
+    c_changed = np.nonzero(c_lines+step_size > col_lines-1)[0]
+
+    # A written sample can depend on other written samples before it, so iterate until nothing changes. The reads
+    # only go backwards in row-major order, so this settles on the sequential result after a few passes.
+    written = lat.copy()
+    for i in range(len(r_lines)+len(c_lines)):
+        prev = written.copy()
+        written[r_changed, :] = legacy_interp_block(interp_type, lat, written, rt, ct, r_lines[r_changed], c_lines)
+        written[:, c_changed] = legacy_interp_block(interp_type, lat, written, rt, ct, r_lines, c_lines[c_changed])
+        if np.array_equal(written, prev):
+            break
+    return written, r_lines[max(r_changed[0]-1, 0)], c_lines[max(c_changed[0]-1, 0)]
+
+def upsample_lattice(interp_type, lat, row_lines, col_lines, step_size):
+    step_size = int(step_size)
+    if interp_type == InterpType.CatmullRom:
+        r_lines = lattice_lines(row_lines, step_size)
+        c_lines = lattice_lines(col_lines, step_size)
+        lat_cols = catmull_rom_axis(lat, np.arange(col_lines), c_lines, 1)
+        return catmull_rom_axis(lat_cols, np.arange(row_lines), r_lines, 0)
+
+    rt = axis_lattice_terms(row_lines, step_size)
+    ct = axis_lattice_terms(col_lines, step_size)
+    all_rows, all_cols = np.arange(row_lines), np.arange(col_lines)
+    grid = legacy_interp_block(interp_type, lat, None, rt, ct, all_rows, all_cols)
+
+    # Only the vertices near the last row/col can read an already written sample, so just those bands are redone.
+    written, r_band, c_band = legacy_written_lattice(interp_type, lat, rt, ct, step_size)
+    grid[r_band:, :] = legacy_interp_block(interp_type, lat, written, rt, ct, all_rows[r_band:], all_cols)
+    grid[:, c_band:] = legacy_interp_block(interp_type, lat, written, rt, ct, all_rows, all_cols[c_band:])
+    return grid
+
+# bidir_interp() of the flat heights z alone, in place. z may be a strided view such as the z column of a vertex
+# buffer, so no (num_pts, 3) array is needed just to interpolate the heights.
+def interp_heights(interp_type, z, row_lines, col_lines, step_size):
+    step_size = int(step_size)
+    lat = z.reshape(row_lines, col_lines)[np.ix_(lattice_lines(row_lines, step_size), lattice_lines(col_lines, step_size))]
+    z[:] = upsample_lattice(interp_type, lat, row_lines, col_lines, step_size).ravel()
+    return z
+
+def bidir_interp(interp_type, verts, row_lines, col_lines, step_size):
+    interp_heights(interp_type, verts[:, 2], row_lines, col_lines, step_size)
+
+# Original per-vertex implementation, kept as the reference for bench_bidir_interp(). Note it indexes the output
+# vertex with row_lines, so it only matches bidir_interp() on square grids.
+def bidir_interp_loop(interp_type, verts, row_lines, col_lines, step_size):
+    half_step = step_size/2
+    for row in range(row_lines):
+        for col in range(col_lines):
+            rq = row//step_size
+            rr = row%step_size
+            r_sm = step_size*rq
+            r_lg = r_sm+step_size
+            r_lg = np.clip(r_lg, r_sm, row_lines-1)
+            r_cls = r_sm if rr <= half_step else r_lg
+
+            cq = col//step_size
+            cr = col%step_size
+            c_sm = step_size*cq
+            c_lg = c_sm+step_size
+            c_lg = np.clip(c_lg, c_sm, col_lines-1)
+            c_cls = c_sm if cr <= half_step else c_lg
+            h_itrp, v_itrp = 0, 0
+
+            dc_s = 1-((col-c_sm)/step_size)
+            dc_l = 1-((c_lg-col)/step_size)
+            dr_s = 1-((row-r_sm)/step_size)
+            dr_l = 1-((r_lg-row)/step_size)
+
+            h_sm = r_cls*col_lines + c_sm
+            h_lg = r_cls*col_lines + c_lg
+            v_sm = r_sm*col_lines + c_cls
+            v_lg = r_lg*col_lines + c_cls
+
+            match interp_type:
+                case InterpType.Bilinear:
+                    h_itrp = dc_s*verts[h_sm][2] + dc_l*verts[h_lg][2]
+                    v_itrp = dr_s*verts[v_sm][2] + dr_l*verts[v_lg][2]
+                case InterpType.Bicubic:
+                    h_itrp = cubic(dc_s)*verts[h_sm][2] + cubic(dc_l)*verts[h_lg][2]
+                    v_itrp = cubic(dr_s)*verts[v_sm][2] + cubic(dr_l)*verts[v_lg][2]
+
+            verts[row*row_lines + col][2] = (h_itrp+v_itrp)*0.5
+
+#------------------------------------------------------------------------------------------------------------------
+
+def bench_bidir_interp(sizes=(121, 201, 257), step_sizes=(1, 5, 10, 40), seed=100):
+    rng = np.random.default_rng(seed)
+    for n in sizes:
+        for step_size in step_sizes:
+            for interp_type in [InterpType.Bilinear, InterpType.Bicubic]:
+                verts = np.zeros((n*n, 3))
+                verts[:, 2] = rng.uniform(-50, 50, n*n)
+                verts_loop = verts.copy()
+
+                start = timeit.default_timer()
+                bidir_interp_loop(interp_type, verts_loop, n, n, step_size)
+                loop_time = timeit.default_timer() - start
+
+                start = timeit.default_timer()
+                bidir_interp(interp_type, verts, n, n, step_size)
+                vec_time = timeit.default_timer() - start
+
+                max_diff = np.max(np.abs(verts[:, 2]-verts_loop[:, 2]))
+                print(interp_type.value + " " + str(n) + "x" + str(n) + " step " + str(step_size) + ": loop " + \
+                    str(round(loop_time, 4)) + "s, vectorized " + str(round(vec_time, 4)) + "s, max abs diff " + str(max_diff))
+
+#------------------------------------------------------------------------------------------------------------------
+
+# Level-synchronous diamond-square on an (n-1)x(n-1) torus, where n = 2^k + 1. Each level fills all square centers,
+# then all edge midpoints, from strided views of the grid with one random draw per pass. Neighbors past an edge
+# wrap around, and the returned n x n grid repeats its first row/col as its last, so the result tiles seamlessly.
+# The corner and every level draw from their own stream of seed (see spawn_seeds()).
+def diamond_square_levels(n, h_min, h_max, r_decay_factor, dtype=np.float32, seed=0):
+    size = n-1
+    corner_rng, *level_rngs = spawn_rngs(seed, 1 + max(size.bit_length()-1, 0))
+    grid = np.zeros((size, size), dtype=dtype)
+    grid[0, 0] = corner_rng.uniform(h_min, h_max)
+    decay = pow(2, -r_decay_factor)
+
+    step = size
+    for rng in level_rngs:
+        hs = step//2
+        m = size//step
+        corners = grid[0::step, 0::step]
+        corners_r = np.roll(corners, -1, axis=0)
+        corners_c = np.roll(corners, -1, axis=1)
+        corners_rc = np.roll(corners_r, -1, axis=1)
+        centers = (corners + corners_r + corners_c + corners_rc)*0.25 + rng.uniform(h_min, h_max, (m, m))
+        grid[hs::step, hs::step] = centers
+
+        edge_noise = rng.uniform(h_min, h_max, (2, m, m))
+        grid[hs::step, 0::step] = (corners + corners_r + np.roll(centers, 1, axis=1) + centers)*0.25 + edge_noise[0]
+        grid[0::step, hs::step] = (corners + corners_c + np.roll(centers, 1, axis=0) + centers)*0.25 + edge_noise[1]
+
+        step = hs
+        h_min *= decay
+        h_max *= decay
+
+    return np.pad(grid, ((0, 1), (0, 1)), mode='wrap')
+
+# Spectral synthesis: white noise is shaped to a 1/f^beta power spectrum in one rfft2/irfft2 pass, O(N log N) for
+# N vertices with no per-octave noise calls. beta around 2 gives rough, around 3 smooth terrain. The FFT is periodic,
+# so with periodic=True the field is built on the (rows-1)x(cols-1) torus and the returned grid repeats its first
+# row/col as its last, which tiles seamlessly. Otherwise it is cut from a field of at least twice the size (a power of
+# 2, where the FFT is fastest), so opposite edges are unrelated. Heights are rescaled to [h_min, h_max].
+# seed may also be a np.random.SeedSequence or Generator.
+def spectral_heights(row_lines, col_lines, beta=2.4, h_min=-50, h_max=50, seed=0, periodic=False):
+    rng = np.random.default_rng(seed)
+    ny, nx = (row_lines-1, col_lines-1) if periodic else (2**ceil(log2(2*row_lines-2)), 2**ceil(log2(2*col_lines-2)))
+    spectrum = np.fft.rfft2(rng.standard_normal((ny, nx)))
+    f = np.hypot(np.fft.fftfreq(ny)[:, None], np.fft.rfftfreq(nx)[None, :])
+    f[0, 0] = 1
+    spectrum *= f**(-0.5*beta)
+    spectrum[0, 0] = 0
+    z = np.fft.irfft2(spectrum, s=(ny, nx))
+    z = np.pad(z, ((0, 1), (0, 1)), mode='wrap') if periodic else z[:row_lines, :col_lines]
+
+    # A field too small to hold anything but the removed mean (e.g. a periodic 2x2 grid) is flat: put it mid-range.
+    z_min, z_max = z.min(), z.max()
+    if z_max == z_min:
+        return np.full(z.shape, (h_min+h_max)/2)
+    return h_min + (z-z_min)*((h_max-h_min)/(z_max-z_min))
+
+#------------------------------------------------------------------------------------------------------------------
+
+# One quad per grid cell, wound counter-clockwise seen from +Z, as an (F,4) int32 array of vertex indices.
+def grid_quad_faces(row_lines, col_lines):
+    v_indices = np.arange(row_lines*col_lines, dtype=np.int32).reshape((row_lines, col_lines))
+    faces = np.empty((row_lines-1, col_lines-1, 4), dtype=np.int32)
+    faces[:, :, 0] = v_indices[:-1, :-1]
+    faces[:, :, 1] = v_indices[:-1, 1:]
+    faces[:, :, 2] = v_indices[1:, 1:]
+    faces[:, :, 3] = v_indices[1:, :-1]
+    return faces.reshape(-1, 4)
+
+# Bytes of grid topology and loop starts kept around. A grid takes about 24 bytes per vertex (int32 x and y, and a
+# quad of int32 indices per cell), 400 MB at 4097x4097, and its loop starts 4 more, so a grid of that size displaces
+# all the others. The most recent entry is kept even if it alone is larger.
+TOPOLOGY_CACHE_BYTES = 512*1024*1024
+
+topology_cache = OrderedDict()
+topology_cache_bytes = 0
+
+# The value of build() for key, from topology_cache if it is there. The least recently used entries are dropped
+# first, once the arrays they hold take more than TOPOLOGY_CACHE_BYTES.
+def cached_topology(key, build):
+    global topology_cache_bytes
+    if key in topology_cache:
+        topology_cache.move_to_end(key)
+        return topology_cache[key]
+
+    value = build()
+    topology_cache[key] = value
+    topology_cache_bytes += topology_nbytes(value)
+    while topology_cache_bytes > TOPOLOGY_CACHE_BYTES and len(topology_cache) > 1:
+        old_key, old_value = topology_cache.popitem(last=False)
+        topology_cache_bytes -= topology_nbytes(old_value)
+    return value
+
+def topology_nbytes(value):
+    return sum(a.nbytes for a in (value if isinstance(value, tuple) else (value,)) if isinstance(a, np.ndarray))
+
+# Vertex x/y coordinates and quad faces for a grid shape. They only depend on (rows, cols, elev_type), so they are
+# shared between calls and returned read-only, see TOPOLOGY_CACHE_BYTES.
+def grid_topology(rows, cols, elev_type):
+    return cached_topology(('grid', rows, cols, elev_type), lambda: build_grid_topology(rows, cols, elev_type))
+
+def build_grid_topology(rows, cols, elev_type):
+    if elev_type == ElevType.DiamondSquare:
+        rows = 2**ceil(log2(rows-1))
+        cols = rows
+    row_lines = rows + 1
+    col_lines = cols + 1
+    num_pts = row_lines*col_lines
+
+    x = np.tile(np.arange(col_lines, dtype=np.int32), row_lines)
+    y = np.repeat(np.arange(row_lines, dtype=np.int32), col_lines)
+    faces = grid_quad_faces(row_lines, col_lines)
+    for a in (x, y, faces):
+        a.setflags(write=False)
+    return row_lines, col_lines, num_pts, faces, x, y
+
+# loop_start of every polygon of a quad mesh, shared read-only like the grid topology.
+def quad_loop_starts(num_faces):
+    return cached_topology(('loop_starts', num_faces), lambda: build_quad_loop_starts(num_faces))
+
+def build_quad_loop_starts(num_faces):
+    loop_starts = np.arange(0, num_faces*4, 4, dtype=np.int32)
+    loop_starts.setflags(write=False)
+    return loop_starts
+
+if __name__ == "__main__":
+    bench_bidir_interp()
@@ -0,0 +1,87 @@
+import numpy as np
+
+import os
+import struct
+import zlib
+
+from height_container import write_height_container
+
+__all__ = (
+    "quantize_u16",
+    "write_png16",
+    "write_raw16",
+    "write_npy",
+    "export_formats",
+    "export_height_map"
+    )
+
+# Rows converted per chunk, so an export never holds more than a slice of the map in a second format.
+EXPORT_ROWS = 256
+
+# Maps heights in [z_min, z_max] (by default the range of z) to the full uint16 range, clamping outside values.
+def quantize_u16(z, z_min, z_max):
+    scale = 65535/(z_max-z_min) if z_max > z_min else 0
+    return np.rint(np.clip((z - z_min)*scale, 0, 65535)).astype(np.uint16)
+
+def height_range(z, z_min=None, z_max=None):
+    return float(np.min(z)) if z_min is None else z_min, float(np.max(z)) if z_max is None else z_max
+
+def png_chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+# 16-bit grayscale PNG with only zlib and struct. Each row uses the Up filter (byte-wise difference to the row above),
+# which suits smooth heightfields, and rows are compressed chunk by chunk into a single IDAT stream.
+def write_png16(path, z, z_min=None, z_max=None):
+    rows, cols = z.shape
+    z_min, z_max = height_range(z, z_min, z_max)
+    compressor = zlib.compressobj(6)
+    idat = []
+    prev_row = np.zeros(2*cols, dtype=np.uint8)
+    for r0 in range(0, rows, EXPORT_ROWS):
+        block = quantize_u16(z[r0:r0+EXPORT_ROWS], z_min, z_max).astype('>u2').view(np.uint8).reshape(-1, 2*cols)
+        filtered = np.empty((len(block), 2*cols+1), dtype=np.uint8)
+        filtered[:, 0] = 2
+        filtered[0, 1:] = block[0] - prev_row
+        filtered[1:, 1:] = block[1:] - block[:-1]
+        prev_row = block[-1].copy()
+        idat.append(compressor.compress(filtered.tobytes()))
+    idat.append(compressor.flush())
+
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(png_chunk(b'IHDR', struct.pack(">IIBBBBB", cols, rows, 16, 0, 0, 0, 0)))
+        f.write(png_chunk(b'IDAT', b''.join(idat)))
+        f.write(png_chunk(b'IEND', b''))
+    return z_min, z_max
+
+# Headerless little-endian uint16 samples, row by row, as read by most engines' RAW/r16 heightmap importers.
+def write_raw16(path, z, z_min=None, z_max=None):
+    z_min, z_max = height_range(z, z_min, z_max)
+    with open(path, 'wb') as f:
+        for r0 in range(0, z.shape[0], EXPORT_ROWS):
+            quantize_u16(z[r0:r0+EXPORT_ROWS], z_min, z_max).astype('<u2').tofile(f)
+    return z_min, z_max
+
+# Writes z (as float32 by default) through a memory-mapped .npy file, chunk by chunk, so giant maps are never copied
+# whole in memory. The result can be read back the same way with np.load(path, mmap_mode='r').
+def write_npy(path, z, dtype=np.float32):
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=z.shape)
+    for r0 in range(0, z.shape[0], EXPORT_ROWS):
+        out[r0:r0+EXPORT_ROWS] = z[r0:r0+EXPORT_ROWS]
+    out.flush()
+    del out
+
+export_formats = {'.png':write_png16, '.r16':write_raw16, '.raw':write_raw16, '.npy':write_npy, '.thc':write_height_container}
+
+# Writes the row_lines x col_lines heights z (a 2D array, or the flat z of a *_height_map() function) in the format
+# given by the file extension. The 16-bit formats return the (z_min, z_max) range that maps to 0 and 65535; a height
+# container (.thc) keeps a range per chunk instead.
+def export_height_map(path, z, row_lines=None, col_lines=None, z_min=None, z_max=None):
+    if row_lines is not None:
+        z = np.reshape(z, (row_lines, col_lines))
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in export_formats:
+        raise ValueError("Unknown heightmap format " + ext + ", expected one of " + ", ".join(export_formats.keys()))
+    if ext in ('.npy', '.thc'):
+        return export_formats[ext](path, z)
+    return export_formats[ext](path, z, z_min, z_max)
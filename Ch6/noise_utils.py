@@ -0,0 +1,241 @@
+import numpy as np
+
+from enum import Enum, unique
+from functools import lru_cache
+from math import floor, pow
+
+try:
+    from mathutils import noise as bl_noise
+except ImportError:
+    bl_noise = None
+
+__all__ = (
+    "NoiseBackend",
+    "noise_basis_names",
+    "noise_array",
+    "hash_uniform",
+    "mathutils_noise_array",
+    "spectral_weights",
+    "hybrid_multi_fractal_array",
+    "multi_fractal_array",
+    "hetero_terrain_array"
+    )
+
+@unique
+class NoiseBackend(str, Enum):
+    NumPy = "numpy"
+    Mathutils = "mathutils"
+
+# Points per batch, which bounds the temporaries of the Voronoi bases (27 candidate cells per point).
+CHUNK_SIZE = 1 << 16
+
+# Fixed tables, so the NumPy bases are deterministic across runs and machines. They play the role of Blender's hash,
+# hashvectf and hashpntf tables, but are not the same numbers, so results resemble mathutils rather than match it.
+table_rng = np.random.default_rng(1986)
+perm = table_rng.permutation(256)
+PERM = np.concatenate([perm, perm])
+unit_grads = table_rng.normal(size=(256, 3))
+UNIT_GRADS = unit_grads/np.linalg.norm(unit_grads, axis=1, keepdims=True)
+BOX_GRADS = table_rng.uniform(-1, 1, (256, 3))
+FEATURE_POINTS = table_rng.uniform(0, 1, (256, 3))
+CELL_VALUES = table_rng.uniform(0, 1, 256)
+
+#------------------------------------------------------------------------------------------------------------------
+
+def hash_cells(ix, iy, iz):
+    return PERM[PERM[PERM[ix & 255] + (iy & 255)] + (iz & 255)]
+
+def floor_split(x, y, z):
+    fx, fy, fz = np.floor(x), np.floor(y), np.floor(z)
+    return fx, fy, fz, fx.astype(np.int64), fy.astype(np.int64), fz.astype(np.int64)
+
+def hermite(t):
+    return t*t*(3 - 2*t)
+
+def quintic(t):
+    return t*t*t*(t*(6*t - 15) + 10)
+
+def improved_grad(h, x, y, z):
+    h = h & 15
+    u = np.where(h < 8, x, y)
+    v = np.where(h < 4, y, np.where((h == 12) | (h == 14), x, z))
+    return np.where(h & 1, -u, u) + np.where(h & 2, -v, v)
+
+def gradient_noise(x, y, z, grad_fn, fade_fn):
+    fx, fy, fz, ix, iy, iz = floor_split(x, y, z)
+    ox, oy, oz = x-fx, y-fy, z-fz
+    u, v, w = fade_fn(ox), fade_fn(oy), fade_fn(oz)
+    n = np.zeros(len(x))
+    for dx in (0, 1):
+        wx = u if dx else 1-u
+        for dy in (0, 1):
+            wy = v if dy else 1-v
+            for dz in (0, 1):
+                wz = w if dz else 1-w
+                h = hash_cells(ix+dx, iy+dy, iz+dz)
+                n += wx*wy*wz*grad_fn(h, ox-dx, oy-dy, oz-dz)
+    return n
+
+def table_grad(table):
+    def grad(h, x, y, z):
+        g = table[h]
+        return g[:, 0]*x + g[:, 1]*y + g[:, 2]*z
+    return grad
+
+def voronoi_distances(x, y, z):
+    fx, fy, fz, ix, iy, iz = floor_split(x, y, z)
+    d = np.empty((len(x), 27))
+    k = 0
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            for dz in (-1, 0, 1):
+                p = FEATURE_POINTS[hash_cells(ix+dx, iy+dy, iz+dz)]
+                d[:, k] = (fx+dx+p[:, 0]-x)**2 + (fy+dy+p[:, 1]-y)**2 + (fz+dz+p[:, 2]-z)**2
+                k += 1
+    d4 = np.partition(d, 3, axis=1)[:, :4]
+    d4.sort(axis=1)
+    return np.sqrt(d4)
+
+#------------------------------------------------------------------------------------------------------------------
+# Signed bases in about [-1, 1], i.e. what mathutils.noise.noise() returns for the same noise_basis name.
+
+def blender_noise(x, y, z):
+    return np.clip(2*gradient_noise(x, y, z, table_grad(BOX_GRADS), hermite), -1, 1)
+
+def perlin_original_noise(x, y, z):
+    return 1.5*gradient_noise(x, y, z, table_grad(UNIT_GRADS), hermite)
+
+def perlin_new_noise(x, y, z):
+    return gradient_noise(x, y, z, improved_grad, quintic)
+
+def voronoi_noise(f):
+    def voronoi(x, y, z):
+        d = voronoi_distances(x, y, z)
+        match f:
+            case 'F2F1':
+                u = d[:, 1]-d[:, 0]
+            case 'CRACKLE':
+                u = np.minimum(10*(d[:, 1]-d[:, 0]), 1)
+            case _:
+                u = d[:, int(f[1])-1]
+        return 2*u - 1
+    return voronoi
+
+def cell_noise(x, y, z):
+    fx, fy, fz, ix, iy, iz = floor_split(x, y, z)
+    return 2*CELL_VALUES[hash_cells(ix, iy, iz)] - 1
+
+noise_basis_funcs = {'BLENDER':blender_noise, 'PERLIN_ORIGINAL':perlin_original_noise, 'PERLIN_NEW':perlin_new_noise, \
+    'VORONOI_F1':voronoi_noise('F1'), 'VORONOI_F2':voronoi_noise('F2'), 'VORONOI_F3':voronoi_noise('F3'), \
+    'VORONOI_F4':voronoi_noise('F4'), 'VORONOI_F2F1':voronoi_noise('F2F1'), 'VORONOI_CRACKLE':voronoi_noise('CRACKLE'), \
+    'CELLNOISE':cell_noise}
+noise_basis_names = list(noise_basis_funcs.keys())
+
+# Stateless integer hash of (seed, salt, ix, iy) to floats in [0, 1), using the splitmix64 finalizer. Used where a
+# value must be reproducible from its lattice coordinates alone, e.g. for terrain tiles generated in any order.
+def hash_uniform(seed, salt, ix, iy):
+    with np.errstate(over='ignore'):
+        h = np.asarray(ix).astype(np.uint64)*np.uint64(0x9E3779B97F4A7C15)
+        h ^= np.asarray(iy).astype(np.uint64)*np.uint64(0xC2B2AE3D27D4EB4F)
+        h ^= np.uint64((seed*0x165667B1 + salt) & 0xFFFFFFFFFFFFFFFF)*np.uint64(0x27D4EB2F165667C5)
+        h ^= h >> np.uint64(30)
+        h *= np.uint64(0xBF58476D1CE4E5B9)
+        h ^= h >> np.uint64(27)
+        h *= np.uint64(0x94D049BB133111EB)
+        h ^= h >> np.uint64(31)
+    return (h >> np.uint64(11)).astype(np.float64)*(1.0/(1 << 53))
+
+#------------------------------------------------------------------------------------------------------------------
+
+def mathutils_array(fn_name, coords, *args, noise_basis='PERLIN_ORIGINAL'):
+    if bl_noise is None:
+        raise ImportError("The mathutils noise backend needs Blender's mathutils module")
+    fn = getattr(bl_noise, fn_name)
+    return np.fromiter((fn(v, *args, noise_basis=noise_basis) for v in coords.tolist()), dtype=np.float64, count=len(coords))
+
+def mathutils_noise_array(coords, noise_basis='PERLIN_ORIGINAL'):
+    return mathutils_array('noise', coords, noise_basis=noise_basis)
+
+# coords is an (N,3) array of positions, the result is the (N,) array of signed noise values at those positions.
+def noise_array(coords, noise_basis='PERLIN_ORIGINAL', backend=NoiseBackend.NumPy):
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+    if backend == NoiseBackend.Mathutils:
+        return mathutils_noise_array(coords, noise_basis)
+
+    basis_fn = noise_basis_funcs[noise_basis]
+    n = np.empty(len(coords))
+    for start in range(0, len(coords), CHUNK_SIZE):
+        c = coords[start:start+CHUNK_SIZE]
+        n[start:start+CHUNK_SIZE] = basis_fn(c[:, 0], c[:, 1], c[:, 2])
+    return n
+
+#------------------------------------------------------------------------------------------------------------------
+
+# Amplitude of each octave, frequency^-H, built the same way as in hybrid_multi_fractal2(). Memoized, since it only
+# depends on the spectral parameters and not on the position being evaluated.
+@lru_cache(maxsize=64)
+def spectral_weights(H, lacunarity, octaves):
+    exp_array = []
+    frequency = 1.0
+    for i in range(int(octaves)+1):
+        exp_array.append(pow(frequency, -H))
+        frequency *= lacunarity
+    exp_array = np.array(exp_array)
+    exp_array.setflags(write=False)
+    return exp_array
+
+# The fractals below evaluate one octave for all positions at a time and keep a running weight/value array per
+# position. With NoiseBackend.Mathutils, hybrid_multi_fractal_array() matches hybrid_multi_fractal2() exactly, and
+# the other two call mathutils' own multi_fractal()/hetero_terrain().
+def hybrid_multi_fractal_array(coords, H=0.25, lacunarity=2, octaves=10, offset=0.7, noise_basis='BLENDER', \
+    backend=NoiseBackend.NumPy):
+    exp_array = spectral_weights(H, lacunarity, octaves)
+    p = np.array(coords, dtype=np.float64).reshape(-1, 3)
+    altitude = np.zeros(len(p))
+    for i in range(octaves):
+        signal = (noise_array(p, noise_basis, backend) + offset) * exp_array[i]
+        if i == 0:
+            altitude = signal
+            weight = altitude.copy()
+        else:
+            np.minimum(weight, 1.0, out=weight)
+            altitude += weight * signal
+            weight *= signal
+        p *= lacunarity
+    return altitude
+
+def multi_fractal_array(coords, H, lacunarity, octaves, noise_basis='PERLIN_ORIGINAL', backend=NoiseBackend.NumPy):
+    p = np.array(coords, dtype=np.float64).reshape(-1, 3)
+    if backend == NoiseBackend.Mathutils:
+        return mathutils_array('multi_fractal', p, H, lacunarity, octaves, noise_basis=noise_basis)
+
+    pw_hl = spectral_weights(H, lacunarity, 1)[1]
+    pwr = 1.0
+    value = np.ones(len(p))
+    for i in range(int(octaves)):
+        value *= pwr*noise_array(p, noise_basis) + 1.0
+        pwr *= pw_hl
+        p *= lacunarity
+    rmd = octaves - floor(octaves)
+    if rmd != 0:
+        value *= rmd*noise_array(p, noise_basis)*pwr + 1.0
+    return value
+
+def hetero_terrain_array(coords, H, lacunarity, octaves, offset, noise_basis='PERLIN_ORIGINAL', backend=NoiseBackend.NumPy):
+    p = np.array(coords, dtype=np.float64).reshape(-1, 3)
+    if backend == NoiseBackend.Mathutils:
+        return mathutils_array('hetero_terrain', p, H, lacunarity, octaves, offset, noise_basis=noise_basis)
+
+    pw_hl = spectral_weights(H, lacunarity, 1)[1]
+    pwr = pw_hl
+    # The first octave is unscaled, later ones are scaled by the value so far.
+    value = offset + noise_array(p, noise_basis)
+    p *= lacunarity
+    for i in range(1, int(octaves)):
+        value += (noise_array(p, noise_basis) + offset)*pwr*value
+        pwr *= pw_hl
+        p *= lacunarity
+    rmd = octaves - floor(octaves)
+    if rmd != 0:
+        value += rmd*(noise_array(p, noise_basis) + offset)*pwr*value
+    return value
@@ -0,0 +1,65 @@
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from height_map_utils import ElevType, spawn_seeds
+from noise_utils import NoiseBackend
+from terrain_tiles import fractal_heights, gen_random_heights
+
+__all__ = (
+    "height_band",
+    "parallel_heights"
+    )
+
+# Rows per band. Bands, and the random stream of each band, are fixed by the grid shape and not by the number of
+# workers, so any worker count gives the same heights.
+BAND_ROWS = 64
+
+# Heights at grid positions x (col) and y (row) for one band, from the same gen_random_heights() and fractal_heights()
+# as the serial height maps. params holds the arguments of the *_height_map() function that the band belongs to.
+def height_band(elev_type, params, x, y, rng):
+    backend = params.get('noise_backend', NoiseBackend.NumPy)
+    if elev_type == ElevType.Random:
+        return gen_random_heights(params['h_min'], params['h_max'], params['noise_basis'], x, y, backend, rng)
+    fractal_params = {k:params[k] for k in ('xy_scale', 'lacunarity', 'octaves', 'offset') if k in params}
+    return fractal_heights(elev_type, x, y, 0, params['noise_basis'], noise_backend=backend, **fractal_params)*params['z_scale']
+
+def eval_band(shm_name, shape, elev_type, params, r0, r1, seed_seq):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        z = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        col_lines = shape[1]
+        x = np.tile(np.arange(col_lines), r1-r0)
+        y = np.repeat(np.arange(r0, r1), col_lines)
+        z[r0:r1] = height_band(elev_type, params, x, y, np.random.default_rng(seed_seq)).reshape(r1-r0, col_lines)
+        del z
+    finally:
+        shm.close()
+
+# Evaluates the heights of a row_lines x col_lines grid in row bands on a process pool. Workers write straight into
+# a shared-memory output array. num_workers <= 1 evaluates the same bands in this process. Each band draws from its
+# own stream of seed (see spawn_seeds()), so the heights do not depend on num_workers. Workers only import this module
+# and its NumPy dependencies, never bpy; from inside Blender, use the 'fork' start method (mp_context) where
+# available, since a spawned worker would try to re-run the Blender script it was started from.
+def parallel_heights(elev_type, row_lines, col_lines, params, num_workers=None, seed=0, band_rows=BAND_ROWS, mp_context=None):
+    shape = (row_lines, col_lines)
+    bands = [(r0, min(r0+band_rows, row_lines)) for r0 in range(0, row_lines, band_rows)]
+    band_seeds = spawn_seeds(seed, len(bands))
+
+    shm = shared_memory.SharedMemory(create=True, size=row_lines*col_lines*np.dtype(np.float64).itemsize)
+    try:
+        if num_workers is not None and num_workers <= 1:
+            for (r0, r1), seed_seq in zip(bands, band_seeds):
+                eval_band(shm.name, shape, elev_type, params, r0, r1, seed_seq)
+        else:
+            with ProcessPoolExecutor(max_workers=num_workers, mp_context=mp_context) as executor:
+                futures = [executor.submit(eval_band, shm.name, shape, elev_type, params, r0, r1, seed_seq) \
+                    for (r0, r1), seed_seq in zip(bands, band_seeds)]
+                for future in futures:
+                    future.result()
+        z = np.ndarray(shape, dtype=np.float64, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    return z.ravel()
@@ -0,0 +1,200 @@
+import numpy as np
+
+import argparse
+import json
+import os, sys
+import platform
+import multiprocessing
+import resource
+import timeit
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+from height_map_utils import ElevType, InterpType, interp_heights, grid_quad_faces, grid_topology
+from noise_utils import noise_basis_names
+from height_filters import filter_heights
+from terrain_core import gen_random_heights, gen_diamond_square_map, grid_verts, hybrid_multi_fractal_height_map, \
+    bl_fractal_height_map, spectral_height_map
+
+# Throughput and memory of each generation phase, per ElevType x noise basis x grid size, e.g.
+#
+#   python terrain_bench.py --sizes 129 513 2049 --out bench.json
+#   python terrain_bench.py --sizes 129 513 2049 --baseline bench.json --threshold 0.15
+#
+# Phases are 'height' (evaluating the heights), 'interp' (interp_heights() of Random and DiamondSquare), 'filter' (the
+# BENCH_FILTERS smoothing of Random and DiamondSquare) and 'mesh' (quad faces and the float32 vertex buffer, plus
+# filling a Blender mesh when run inside Blender). Each phase reports vertices/second of its best run and two memory
+# figures. peak_traced_bytes is the peak of the allocations traced in a separate tracemalloc run (NumPy reports its
+# arrays to it), so not the memory of the process. rss_growth_bytes is how far the phase raised the process' peak RSS
+# (ru_maxrss, a high-water mark), i.e. the memory it needed beyond what the earlier phases of its case already took.
+# Outside Blender each case runs in a fresh process, so no earlier case inflates it.
+
+BENCH_SIZES = (129, 257, 513, 1025, 2049, 4097)
+
+# Smoothing of the 'filter' phase, a bilateral filter followed by sharpening.
+BENCH_FILTERS = [{'type':'bilateral', 'sigma':1.5, 'sigma_range':15}, {'type':'unsharp', 'amount':0.5}]
+
+# ElevTypes whose heights do not depend on a noise basis.
+BASISLESS_TYPES = (ElevType.DiamondSquare, ElevType.Spectral)
+
+def phase_height(elev_type, noise_basis, rows, cols):
+    def height(state):
+        row_lines, col_lines, num_pts, faces, x, y = grid_topology(rows, cols, elev_type)
+        match elev_type:
+            case ElevType.Random:
+                z = gen_random_heights(-50, 50, noise_basis, x, y, rng=np.random.default_rng(100))
+            case ElevType.DiamondSquare:
+                z = gen_diamond_square_map(row_lines, num_pts, -50, 50, np.float32, seed=100)
+            case ElevType.HybridMultiFractal:
+                z = hybrid_multi_fractal_height_map(rows, cols, noise_basis)
+            case ElevType.BlenderMultiFractal | ElevType.BlenderHeteroTerrain:
+                z = bl_fractal_height_map(rows, cols, elev_type, noise_basis)
+            case ElevType.Spectral:
+                z = spectral_height_map(rows, cols)
+        return {**state, 'z':z}
+    return height
+
+def phase_interp(elev_type, rows, cols):
+    def interp(state):
+        row_lines, col_lines, num_pts, faces, x, y = grid_topology(rows, cols, elev_type)
+        z = np.array(state['z'], dtype=np.float64)
+        return {**state, 'z':interp_heights(InterpType.Bicubic, z, row_lines, col_lines, 10)}
+    return interp
+
+def phase_filter(elev_type, rows, cols):
+    def smooth(state):
+        row_lines, col_lines, num_pts, faces, x, y = grid_topology(rows, cols, elev_type)
+        return {**state, 'z':filter_heights(state['z'], row_lines, col_lines, BENCH_FILTERS)}
+    return smooth
+
+def phase_mesh(elev_type, rows, cols):
+    def mesh(state):
+        row_lines, col_lines, num_pts, faces, x, y = grid_topology(rows, cols, elev_type)
+        faces = grid_quad_faces(row_lines, col_lines)
+        verts = grid_verts(1, (0, 0, 0), num_pts, x, y, state['z'])
+        if bpy is not None:
+            from fractal_terrain_generator import fill_grid_mesh
+            bench_mesh = bpy.data.meshes.new(name="bench_mesh")
+            fill_grid_mesh(bench_mesh, verts, faces)
+            bpy.data.meshes.remove(bench_mesh)
+        return {**state, 'verts':verts}
+    return mesh
+
+def bench_phases(elev_type, noise_basis, rows, cols):
+    phases = [('height', phase_height(elev_type, noise_basis, rows, cols))]
+    if elev_type in (ElevType.Random, ElevType.DiamondSquare):
+        phases.append(('interp', phase_interp(elev_type, rows, cols)))
+        phases.append(('filter', phase_filter(elev_type, rows, cols)))
+    phases.append(('mesh', phase_mesh(elev_type, rows, cols)))
+    return phases
+
+def peak_rss_bytes():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss*1024
+
+# Runs the phases of one case repeat times, keeping the best time of each phase and the RSS growth of the first run,
+# then once more under tracemalloc.
+def bench_case(elev_type, noise_basis, size, repeat=1):
+    rows = cols = size-1
+    phases = bench_phases(elev_type, noise_basis, rows, cols)
+    num_pts = grid_topology(rows, cols, elev_type)[2]
+    best = {phase:float('inf') for phase, fn in phases}
+    rss_growth = {}
+    for i in range(repeat):
+        state = {}
+        for phase, fn in phases:
+            rss = peak_rss_bytes()
+            start = timeit.default_timer()
+            state = fn(state)
+            best[phase] = min(best[phase], timeit.default_timer()-start)
+            if i == 0:
+                rss_growth[phase] = peak_rss_bytes()-rss
+
+    peaks = {}
+    state = {}
+    tracemalloc.start()
+    try:
+        for phase, fn in phases:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            state = fn(state)
+            peaks[phase] = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+
+    return [{'elev_type':elev_type.value, 'noise_basis':noise_basis, 'size':size, 'phase':phase, 'verts':num_pts, \
+        'seconds':best[phase], 'verts_per_s':num_pts/max(best[phase], 1e-9), 'peak_traced_bytes':peaks[phase], \
+        'rss_growth_bytes':rss_growth[phase]} for phase, fn in phases]
+
+# bench_case() in a fresh spawned process outside Blender (a spawned worker could not re-run a Blender script).
+def isolated_bench_case(elev_type, noise_basis, size, repeat=1):
+    if bpy is not None:
+        return bench_case(elev_type, noise_basis, size, repeat)
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(bench_case, elev_type, noise_basis, size, repeat).result()
+
+def run_benchmarks(elev_types, noise_bases, sizes, repeat=1, log=print):
+    results = []
+    for size in sizes:
+        for elev_type in elev_types:
+            bases = [b for b in noise_bases if b != 'UNIFORM' or elev_type == ElevType.Random]
+            for noise_basis in (['-'] if elev_type in BASISLESS_TYPES else bases):
+                for r in isolated_bench_case(elev_type, noise_basis, size, repeat):
+                    results.append(r)
+                    log(r['elev_type'] + " " + r['noise_basis'] + " " + str(size) + "^2 " + r['phase'] + ": " + \
+                        str(round(r['seconds'], 4)) + "s, " + str(round(r['verts_per_s']/1e6, 3)) + " Mverts/s, peak traced " + \
+                        str(round(r['peak_traced_bytes']/2**20, 1)) + " MB, RSS +" + str(round(r['rss_growth_bytes']/2**20, 1)) + " MB")
+    return {'meta':{'python':platform.python_version(), 'numpy':np.__version__, 'machine':platform.machine(), \
+        'platform':platform.platform(), 'cpu_count':os.cpu_count(), 'blender':bpy is not None}, 'results':results}
+
+def result_key(r):
+    return (r['elev_type'], r['noise_basis'], r['size'], r['phase'])
+
+# Cases whose throughput dropped by more than threshold (a fraction) against the baseline, as
+# (key, baseline verts/s, verts/s) tuples.
+def find_regressions(report, baseline, threshold=0.1):
+    base = {result_key(r):r for r in baseline['results']}
+    regressions = []
+    for r in report['results']:
+        b = base.get(result_key(r))
+        if b is not None and r['verts_per_s'] < b['verts_per_s']*(1-threshold):
+            regressions.append((result_key(r), b['verts_per_s'], r['verts_per_s']))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Ch6 terrain generation phases.")
+    parser.add_argument('--elev-types', nargs='+', default=[e.value for e in ElevType], choices=[e.value for e in ElevType])
+    parser.add_argument('--bases', nargs='+', default=['UNIFORM', 'PERLIN_NEW', 'VORONOI_F1'], choices=['UNIFORM']+noise_basis_names, \
+        help="noise bases; UNIFORM only applies to Random")
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(BENCH_SIZES[:3]), \
+        help="vertices per side, 2^k+1 for the same grid in every ElevType; the full suite is " + " ".join(str(n) for n in BENCH_SIZES))
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--out', default=None, help="write the results as JSON")
+    parser.add_argument('--baseline', default=None, help="JSON results to compare against")
+    parser.add_argument('--threshold', type=float, default=0.1, help="allowed throughput drop, as a fraction")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks([ElevType(e) for e in args.elev_types], args.bases, args.sizes, args.repeat)
+
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=1)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(report, baseline, args.threshold)
+        for key, base_vps, vps in regressions:
+            print("REGRESSION " + " ".join(str(k) for k in key) + ": " + str(round(base_vps/1e6, 3)) + " -> " + \
+                str(round(vps/1e6, 3)) + " Mverts/s")
+        print(str(len(regressions)) + " regressions beyond " + str(args.threshold*100) + "%")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+import argparse
+import inspect
+import json
+import os, sys
+import timeit
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+from height_map_utils import grid_topology
+from terrain_core import height_map_funcs, finish_height_map
+from heightmap_export import export_height_map
+from height_cache import HeightMapCache, cached_height_map
+
+# Batch heightmap generation without Blender, e.g.
+#
+#   python terrain_cli.py jobs.toml --out-dir out
+#
+# A job file (TOML or JSON) holds an optional [defaults] table that is merged into every job, and a list of [[jobs]]:
+#
+#   [defaults]
+#   rows = 256
+#   cols = 256
+#
+#   [[jobs]]
+#   generator = "hybrid_multi_fractal"
+#   output = "hmf_perlin.npy"
+#   noise_basis = "PERLIN_NEW"
+#   z_scale = 15
+#   erosion = { hydraulic_iterations = 40 }
+#
+#   [[jobs]]
+#   generator = "diamond_square"
+#   output = "ds_smooth.png"
+#   seed = 3
+#   filters = [{ type = "bilateral", sigma = 2, sigma_range = 8 }, { type = "unsharp", amount = 0.5 }]
+#
+# The extension of output picks the format: .npy (float32), 16-bit .png or .r16/.raw, which map the optional
+# z_min..z_max range (by default the range of the heights) to 0..65535, or a chunked, mip-mapped height container
+# .thc (see height_container.py).
+#
+# generator is one of the height_map_funcs keys in terrain_core.py; every other key except cell_width, chop_border,
+# erosion, filters (see filter_heights() in height_filters.py), output, z_min and z_max is passed on to that
+# *_height_map() function. seed is passed on to the generators that take one, which is every generator that draws
+# random numbers. chop_border defaults to false.
+
+JOB_KEYS = ('generator', 'output', 'seed', 'cell_width', 'chop_border', 'erosion', 'filters', 'z_min', 'z_max')
+
+def load_jobs(path):
+    with open(path, 'rb') as f:
+        if path.endswith('.toml'):
+            if tomllib is None:
+                raise ImportError("TOML job files need Python 3.11+ (tomllib), use a JSON job file instead")
+            spec = tomllib.load(f)
+        else:
+            spec = json.load(f)
+    defaults = spec.get('defaults', {})
+    return [{**defaults, **job} for job in spec['jobs']]
+
+# Returns the finished heights of one job as a row_lines x col_lines array.
+def run_job(job, num_workers=None, cache=None):
+    height_map_fn, elev_type = height_map_funcs[job['generator']]
+    params = {k:v for k, v in job.items() if k not in JOB_KEYS}
+    fn_params = inspect.signature(height_map_fn).parameters
+    if 'elev_type' in fn_params:
+        params['elev_type'] = elev_type
+    if 'seed' in job and 'seed' in fn_params:
+        params['seed'] = job['seed']
+    if num_workers is not None and 'num_workers' in fn_params:
+        params['num_workers'] = num_workers
+
+    z = cached_height_map(cache, job['generator'], params)
+    row_lines, col_lines, num_pts, faces, x, y = grid_topology(params['rows'], params['cols'], elev_type)
+    z = finish_height_map(z, row_lines, col_lines, elev_type, job.get('cell_width', 1), job.get('chop_border', False), \
+        job.get('erosion'), filters=job.get('filters'))
+    return z.reshape(row_lines, col_lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate heightmaps from TOML/JSON job files, without Blender.")
+    parser.add_argument('job_files', nargs='+')
+    parser.add_argument('--out-dir', default='.', help="directory for relative output paths")
+    parser.add_argument('--num-workers', type=int, default=None, help="process pool size for generators that have one")
+    parser.add_argument('--cache-dir', default=None, help="reuse heightmaps generated with the same parameters")
+    parser.add_argument('--cache-mb', type=int, default=1024, help="size bound of the cache directory")
+    args = parser.parse_args(argv)
+    cache = None if args.cache_dir is None else HeightMapCache(args.cache_dir, args.cache_mb*1024*1024)
+
+    for job_file in args.job_files:
+        for i, job in enumerate(load_jobs(job_file)):
+            output = os.path.join(args.out_dir, job.get('output', os.path.splitext(os.path.basename(job_file))[0]+"_"+str(i)+".npy"))
+            start = timeit.default_timer()
+            z = run_job(job, args.num_workers, cache)
+            os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+            z_range = export_height_map(output, z, z_min=job.get('z_min'), z_max=job.get('z_max'))
+            print(job['generator'] + " " + str(z.shape[0]) + "x" + str(z.shape[1]) + " -> " + output + " (" + \
+                str(round(timeit.default_timer()-start, 3)) + "s)" + ("" if z_range is None else ", z range " + str(z_range)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
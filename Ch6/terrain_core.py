@@ -0,0 +1,374 @@
+import numpy as np
+
+from math import floor, pow
+
+try:
+    from mathutils import noise
+except ImportError:
+    noise = None
+
+from height_map_utils import ElevType, InterpType, spawn_seeds, spawn_rngs, lattice_lines, upsample_lattice, interp_heights, diamond_square_levels, \
+    spectral_heights, grid_topology
+from noise_utils import NoiseBackend, spectral_weights
+from parallel_utils import parallel_heights
+from erosion_utils import erode_heights
+from height_filters import filter_heights
+from terrain_tiles import fractal_heights, gen_random_heights
+
+# Height generation without Blender: every *_height_map() function returns the flat z array of the grid that
+# grid_topology(rows, cols, elev_type) describes, and the gen_*_mesh functions of fractal_terrain_generator.py
+# only turn it into a mesh.
+__all__ = (
+    "gen_random_heights",
+    "gen_random_map",
+    "gen_random_lattice",
+    "fbm_sum",
+    "gen_diamond_square_map",
+    "hybrid_multi_fractal2",
+    "create_blank_height_map",
+    "add_border",
+    "VERTEX_MEMORY_OVERHEAD",
+    "alloc_grid_verts",
+    "grid_verts",
+    "fractal_grid_verts",
+    "random_height_map",
+    "random_fbm_height_map",
+    "ds_height_map",
+    "hybrid_multi_fractal_height_map",
+    "bl_fractal_height_map",
+    "spectral_height_map",
+    "height_map_funcs",
+    "finish_height_map",
+    "PREVIEW_STRIDES",
+    "progressive_height_maps"
+    )
+
+#--------------------------------------------------------------------------------------------------------
+
+def gen_random_map(num_pts, h_min, h_max, noise_basis, x, y, noise_backend=NoiseBackend.NumPy, rng=None):
+    z = gen_random_heights(h_min, h_max, noise_basis, x, y, noise_backend, rng)
+    verts = np.stack([x, y, z], axis=-1).reshape(num_pts, 3)
+    return verts
+
+# Samples only the control lattice that bidir_interp() reads for this step_size, instead of every vertex.
+def gen_random_lattice(h_min, h_max, noise_basis, row_lines, col_lines, step_size, noise_backend=NoiseBackend.NumPy, rng=None):
+    r_lines = lattice_lines(row_lines, step_size)
+    c_lines = lattice_lines(col_lines, step_size)
+    lat_x = np.tile(c_lines, len(r_lines))
+    lat_y = np.repeat(r_lines, len(c_lines))
+    return gen_random_heights(h_min, h_max, noise_basis, lat_x, lat_y, noise_backend, rng).reshape(len(r_lines), len(c_lines))
+
+# Sums the octaves into the heights of verts, which may also be the flat heights alone. Each octave draws from its
+# own stream of seed. Noise bases other than UNIFORM draw nothing and give every octave the same raw heights, so they
+# are evaluated once, on num_workers processes if num_workers > 0 (see parallel_heights()), and each octave only
+# interpolates a copy. UNIFORM draws are cheap next to the interpolation and stay in this process.
+def fbm_sum(verts, interp_type, noise_basis, unit_size, h_min, h_max, num_octaves, row_lines, col_lines, num_pts, x, y, \
+    lattice_only=False, noise_backend=NoiseBackend.NumPy, seed=0, num_workers=0, mp_context=None):
+    if unit_size < 1 or num_octaves < 1:
+        return
+    z = verts[:,2] if verts.ndim == 2 else verts
+    noise_z = None
+    div_pow = [int(pow(2, i)) for i in range(0, num_octaves)]
+    for dp, rng in zip(div_pow, spawn_rngs(seed, num_octaves)):
+        step_size = floor(unit_size//dp)
+        if step_size < 1:
+            break
+        
+        if lattice_only:
+            lat = gen_random_lattice(h_min, h_max, noise_basis, row_lines, col_lines, step_size, noise_backend, rng)
+            z += (1/dp)*upsample_lattice(interp_type, lat, row_lines, col_lines, step_size).ravel()
+            continue
+
+        if noise_basis == 'UNIFORM':
+            z_this_oct = gen_random_heights(h_min, h_max, noise_basis, x, y, noise_backend, rng)
+        else:
+            if noise_z is None:
+                if num_workers > 0:
+                    params = {'noise_basis':noise_basis, 'h_min':h_min, 'h_max':h_max, 'noise_backend':noise_backend}
+                    noise_z = parallel_heights(ElevType.Random, row_lines, col_lines, params, num_workers, mp_context=mp_context)
+                else:
+                    noise_z = gen_random_heights(h_min, h_max, noise_basis, x, y, noise_backend)
+            z_this_oct = noise_z.copy()
+        interp_heights(interp_type, z_this_oct, row_lines, col_lines, step_size)
+        z += (1/dp)*z_this_oct
+        
+#--------------------------------------------------------------------------------------------------------
+
+def sample_ds_noise(h_min, h_max, rng):
+    dsn = (h_max-h_min)*rng.random()+h_min
+    return dsn
+
+def diamond_square_step(s, grid, h_min, h_max, rng):
+    h, w  = grid.shape
+    for r in range(0, h, s):
+        for c in range(0, w, s):
+            r_s = (r+s)%h
+            c_s = (c+s)%w
+            square = np.array([grid[r][c], grid[r][c_s], grid[r_s][c_s], grid[r_s][c]])
+            hs = s//2
+            sc = np.mean(square) + sample_ds_noise(h_min, h_max, rng)
+            r_hs = (r+hs)%h
+            c_hs = (c+hs)%w
+            grid[r_hs][c_hs] = sc
+                      
+            diamond_0 = np.array([grid[r_hs][(c-hs)%w], grid[r][c], sc, grid[r_s][c]])
+            grid[r_hs][c] = np.mean(diamond_0) + rng.uniform(h_min, h_max)
+            
+            diamond_1 = np.array([grid[r][c], grid[(r-hs)%h][c_hs], grid[r][c_s], sc])
+            grid[r][c_hs] = np.mean(diamond_1) + rng.uniform(h_min, h_max)
+            
+            diamond_2 = np.array([sc, grid[r][c_s], grid[r_hs][(c+s+hs)%w], grid[r_s][c_s]])
+            grid[r_hs][c_s] = np.mean(diamond_2) + rng.uniform(h_min, h_max)
+            
+            diamond_3 = np.array([grid[r_s][c], sc, grid[r_s][c_s], grid[(r+s+hs)%h][c_hs]])
+            grid[r_s][c_hs] = np.mean(diamond_3) + rng.uniform(h_min, h_max)
+            
+# Every step size draws from its own stream of seed.
+def diamond_square(n, grid, h_min, h_max, r_decay_factor, seed=0):
+    step = n-1
+    for rng in spawn_rngs(seed, (n-1).bit_length()):
+        diamond_square_step(step, grid, h_min, h_max, rng)
+        step = step//2
+        decay = pow(2, -r_decay_factor)
+        h_min *= decay
+        h_max *= decay
+        
+    return grid
+
+def gen_diamond_square_map(row_lines, num_pts, h_min, h_max, dtype=np.float32, seed=0):
+    n = row_lines
+    if dtype is not None:
+        return diamond_square_levels(n, h_min, h_max, 0.3, dtype, seed).flatten()
+
+    ds_grid = np.zeros((n,n), dtype=np.float16)
+    h_range = h_max-h_min
+
+    corner_seed, levels_seed = spawn_seeds(seed, 2)
+    corner_rng = np.random.default_rng(corner_seed)
+    ds_grid[0, 0] = sample_ds_noise(h_min, h_max, corner_rng)
+    ds_grid[0, n-1] = sample_ds_noise(h_min, h_max, corner_rng)
+    ds_grid[n-1, 0] = sample_ds_noise(h_min, h_max, corner_rng)
+    ds_grid[n-1, n-1] = sample_ds_noise(h_min, h_max, corner_rng)
+    
+    diamond_square(n, ds_grid, h_min, h_max, 0.3, levels_seed)
+    z = ds_grid.flatten()
+    return z
+    
+#-------------------------------------------------------------------------------------------------------
+
+def hybrid_multi_fractal2(v, H=0.25, lacunarity=2, octaves=10, offset=0.7, noise_basis='BLENDER'):
+    exp_array = spectral_weights(H, lacunarity, octaves)
+
+    for i in range(octaves):
+        if i == 0:
+            altitude = (noise.noise(v, noise_basis=noise_basis) + offset) * exp_array[0]
+            weight = altitude
+        else:
+            weight = min(weight, 1.0)
+            signal = (noise.noise(v, noise_basis=noise_basis) + offset) * exp_array[i]
+            altitude += weight * signal
+            weight *= signal
+
+        v = [v[i]*lacunarity for i in range(3)]
+
+    return altitude
+
+#-------------------------------------------------------------------------------------------------------
+
+def create_blank_height_map(rows, cols, elev_type):
+    row_lines, col_lines, num_pts, faces, x, y = grid_topology(rows, cols, elev_type)
+    z = np.zeros(num_pts)
+    return row_lines, col_lines, num_pts, faces, x, y, z
+
+# Zeroes the border of the rows r0 onwards of a row_lines x col_lines grid, held by the flat heights z (which may be a
+# band of rows, or a strided view such as the z column of a vertex buffer).
+def add_border_rows(z, r0, row_lines, col_lines, elev_type):
+    border = 5 if elev_type == ElevType.Random or elev_type == ElevType.DiamondSquare else 1
+    z2 = z.reshape(-1, col_lines)
+    z2[:, :border] = 0
+    z2[:, col_lines-border:] = 0
+    rows = np.arange(r0, r0+len(z2))
+    z2[(rows < border) | (rows >= row_lines-border)] = 0
+
+def add_border(z, row_lines, col_lines, elev_type):
+    add_border_rows(z, 0, row_lines, col_lines, elev_type)
+
+#-------------------------------------------------------------------------------------------------------
+
+# Memory of the vertex path. A mesh's (num_pts, 3) float32 vertex buffer (12 bytes per vertex) is allocated once
+# by alloc_grid_verts() and filled in place: the x/y columns by ufuncs writing straight into them, and z from the
+# heights (see grid_verts()). fractal_grid_verts() evaluates the heights in bands of rows written into the z column,
+# sized so the temporaries of a band stay within VERTEX_MEMORY_OVERHEAD of the buffer: its peak is about 1.2x the
+# vertex buffer.
+# Only this fractal path has that bound. The other generators build whole float64 height maps with their own
+# temporaries before grid_verts() copies them in; their traced peaks at 1024x1024 are about 3.5-4x the vertex buffer
+# for Random, random fbm and DiamondSquare, and about 9x for Spectral, whose FFT field is twice the grid's size each
+# way. Erosion and filters add to that. Not counted are the grid topology (x, y and faces) and loop starts, which are
+# cached and shared by every mesh of the same shape.
+VERTEX_MEMORY_OVERHEAD = 0.2
+
+# Upper bound of the temporary bytes per vertex of fractal_heights(), measured with tracemalloc for the fractal
+# ElevTypes at their default octaves; the Voronoi bases take the most, about 600.
+FRACTAL_TEMP_BYTES = 640
+
+# Smallest band, so small grids are not split into bands too short to vectorize well. Below about 1000x1000 vertices
+# this band, under 3 MB of temporaries, is more than VERTEX_MEMORY_OVERHEAD of the buffer.
+MIN_BAND_VERTS = 4096
+
+# Float32 vertex buffer of the grid with x and y filled in and z left for the caller.
+def alloc_grid_verts(cell_width, origin, num_pts, x, y):
+    verts = np.empty((num_pts, 3), dtype=np.float32)
+    for axis, coords in enumerate((x, y)):
+        np.multiply(coords, cell_width, out=verts[:,axis])
+        verts[:,axis] += origin[axis]
+    return verts
+
+def grid_verts(cell_width, origin, num_pts, x, y, z):
+    verts = alloc_grid_verts(cell_width, origin, num_pts, x, y)
+    np.add(z, origin[2], out=verts[:,2])
+    return verts
+
+# The vertex buffer of a fractal ElevType grid (HybridMultiFractal or the Blender fractals), as built from
+# hybrid_multi_fractal_height_map() or bl_fractal_height_map() and grid_verts(), but with the heights evaluated
+# band by band into the buffer, see VERTEX_MEMORY_OVERHEAD.
+def fractal_grid_verts(elev_type, rows, cols, cell_width, origin, noise_basis='PERLIN_NEW', xy_scale=0.025, lacunarity=3, \
+    octaves=5, offset=0.25, z_scale=1, chop_border=True, noise_backend=NoiseBackend.NumPy, band_rows=None):
+    row_lines, col_lines, num_pts, faces, x, y = grid_topology(rows, cols, elev_type)
+    verts = alloc_grid_verts(cell_width, origin, num_pts, x, y)
+    if band_rows is None:
+        band_rows = max(-(-MIN_BAND_VERTS//col_lines), int(VERTEX_MEMORY_OVERHEAD*verts.nbytes/(FRACTAL_TEMP_BYTES*col_lines)))
+
+    for r0 in range(0, row_lines, band_rows):
+        band = slice(r0*col_lines, min(r0+band_rows, row_lines)*col_lines)
+        z = fractal_heights(elev_type, x[band], y[band], 0, noise_basis, xy_scale, lacunarity, octaves, offset, noise_backend)
+        z *= z_scale
+        if chop_border:
+            add_border_rows(z, r0, row_lines, col_lines, elev_type)
+        np.add(z, origin[2], out=verts[band, 2])
+    return verts
+
+#-------------------------------------------------------------------------------------------------------
+
+def hybrid_multi_fractal_height_map(rows, cols, noise_basis, xy_scale=0.025, lacunarity=3, octaves=5, offset=0.25, z_scale=1, \
+    noise_backend=NoiseBackend.NumPy, num_workers=0, mp_context=None):
+    elev_type = ElevType.HybridMultiFractal
+    row_lines, col_lines, num_pts, faces, x, y = grid_topology(rows, cols, elev_type)
+
+    if num_workers > 0:
+        params = {'noise_basis':noise_basis, 'xy_scale':xy_scale, 'lacunarity':lacunarity, 'octaves':octaves, 'offset':offset, \
+            'z_scale':z_scale, 'noise_backend':noise_backend}
+        return parallel_heights(elev_type, row_lines, col_lines, params, num_workers, mp_context=mp_context)
+
+    return fractal_heights(elev_type, x, y, 0, noise_basis, xy_scale, lacunarity, octaves, offset, noise_backend)*z_scale
+
+def bl_fractal_height_map(rows, cols, elev_type=ElevType.HybridMultiFractal, noise_basis='PERLIN_NEW', z_scale=1, \
+    noise_backend=NoiseBackend.NumPy, num_workers=0, mp_context=None):
+    row_lines, col_lines, num_pts, faces, x, y = grid_topology(rows, cols, elev_type)
+
+    match elev_type:
+        case ElevType.BlenderMultiFractal | ElevType.BlenderHeteroTerrain if num_workers > 0:
+            params = {'noise_basis':noise_basis, 'z_scale':z_scale, 'noise_backend':noise_backend}
+            z = parallel_heights(elev_type, row_lines, col_lines, params, num_workers, mp_context=mp_context)
+        case ElevType.BlenderMultiFractal | ElevType.BlenderHeteroTerrain:
+            z = fractal_heights(elev_type, x, y, 0, noise_basis, noise_backend=noise_backend)*z_scale
+        case _:
+            z = np.zeros(num_pts)
+    return z
+
+# seed (an int, np.random.SeedSequence or Generator) selects the random streams of the Random and DiamondSquare
+# height maps, see spawn_seeds(); the same seed gives the same heights, whatever was generated before.
+# dtype is the grid of the level-synchronous diamond_square_levels(), float32 by default; None runs the original
+# per-square float16 loop instead, which gives other heights and is far slower. DiamondSquare takes no num_workers:
+# each level is built from the whole of the one before, so it does not split into independent bands, and
+# diamond_square_levels() already does each level in a few whole-grid passes.
+def ds_height_map(rows, cols, unit_size=10, h_min=-50, h_max=50, interp_type=InterpType.Bicubic, dtype=np.float32, seed=0):
+    elev_type = ElevType.DiamondSquare
+    row_lines, col_lines, num_pts, faces, x, y = grid_topology(rows, cols, elev_type)
+    z = gen_diamond_square_map(row_lines, num_pts, h_min, h_max, dtype, seed).astype(np.float64)
+    return interp_heights(interp_type, z, row_lines, col_lines, unit_size)
+
+def random_fbm_height_map(rows, cols, noise_basis, unit_size=5, h_min=-50, h_max=50, num_octaves=4, \
+    interp_type=InterpType.Bicubic, lattice_only=False, noise_backend=NoiseBackend.NumPy, num_workers=0, mp_context=None, seed=0):
+    elev_type = ElevType.Random
+    row_lines, col_lines, num_pts, faces, x, y = grid_topology(rows, cols, elev_type)
+
+    z = np.zeros(num_pts)
+    fbm_unit_size = pow(2, num_octaves-1)*unit_size
+    fbm_sum(z, interp_type, noise_basis, fbm_unit_size, h_min, h_max, num_octaves, row_lines, col_lines, num_pts, x, y, \
+        lattice_only, noise_backend, seed, num_workers, mp_context)
+    return z
+
+def random_height_map(rows, cols, noise_basis, unit_size=5, h_min=-50, h_max=50, interp_type=InterpType.Bicubic, \
+    lattice_only=False, noise_backend=NoiseBackend.NumPy, num_workers=0, mp_context=None, seed=0):
+    elev_type = ElevType.Random
+    row_lines, col_lines, num_pts, faces, x, y = grid_topology(rows, cols, elev_type)
+
+    if lattice_only:
+        lat = gen_random_lattice(h_min, h_max, noise_basis, row_lines, col_lines, 10, noise_backend, np.random.default_rng(seed))
+        return upsample_lattice(interp_type, lat, row_lines, col_lines, 10).ravel()
+
+    # UNIFORM heights always come from the per-band streams of parallel_heights() (in this process for num_workers 0),
+    # so any worker count gives the same heights.
+    if num_workers > 0 or noise_basis == 'UNIFORM':
+        params = {'noise_basis':noise_basis, 'h_min':h_min, 'h_max':h_max, 'noise_backend':noise_backend}
+        z = parallel_heights(elev_type, row_lines, col_lines, params, num_workers, seed=seed, mp_context=mp_context)
+    else:
+        z = gen_random_heights(h_min, h_max, noise_basis, x, y, noise_backend)
+    return interp_heights(interp_type, z, row_lines, col_lines, 10)
+
+# 1/f^beta terrain from one inverse FFT, a cheap baseline for large maps. See spectral_heights().
+def spectral_height_map(rows, cols, beta=2.4, h_min=-50, h_max=50, seed=0, periodic=False):
+    row_lines, col_lines, num_pts, faces, x, y = grid_topology(rows, cols, ElevType.Spectral)
+    return spectral_heights(row_lines, col_lines, beta, h_min, h_max, seed, periodic).ravel()
+
+# Generator names for job files (see terrain_cli.py), with the ElevType of the grid each one builds.
+height_map_funcs = {'random':(random_height_map, ElevType.Random), 'random_fbm':(random_fbm_height_map, ElevType.Random), \
+    'diamond_square':(ds_height_map, ElevType.DiamondSquare), \
+    'hybrid_multi_fractal':(hybrid_multi_fractal_height_map, ElevType.HybridMultiFractal), \
+    'blender_multi_fractal':(bl_fractal_height_map, ElevType.BlenderMultiFractal), \
+    'blender_hetero_terrain':(bl_fractal_height_map, ElevType.BlenderHeteroTerrain), \
+    'spectral':(spectral_height_map, ElevType.Spectral)}
+
+# The post-processing of finish_mesh() that does not need Blender: optional erosion (a dict of erode_heights()
+# params plus an optional 'num_workers'), optional filters (a list of filter_heights() dicts), then the zeroed border.
+def finish_height_map(z, row_lines, col_lines, elev_type, cell_width=1, chop_border=True, erosion=None, mp_context=None, \
+    filters=None):
+    if erosion is not None:
+        z = erode_heights(z, row_lines, col_lines, cell_width, erosion, erosion.get('num_workers', 0), mp_context=mp_context)
+    if filters:
+        z = filter_heights(z, row_lines, col_lines, filters)
+    if chop_border:
+        add_border(z, row_lines, col_lines, elev_type)
+    return z
+
+#-------------------------------------------------------------------------------------------------------
+
+# Lattice strides of the progressive preview stages, coarsest first.
+PREVIEW_STRIDES = (8, 4, 2, 1)
+
+# Coarse-to-fine evaluation of a fractal ElevType, e.g. to preview parameter changes quickly. Yields (stride, z) per
+# stage, where z is the flat heights of the full grid: sampled every stride-th row/col (and on the last ones), and
+# Catmull-Rom upsampled in between. Each stage only evaluates the samples that no coarser stage did, so all stages
+# together cost one full evaluation, and the last one (stride 1) gives the heights of
+# hybrid_multi_fractal_height_map() and bl_fractal_height_map() for the same noise_backend. It is only used by the
+# Blender preview, so it defaults to NoiseBackend.Mathutils like the gen_*_mesh adapters whose meshes it previews.
+def progressive_height_maps(elev_type, rows, cols, noise_basis, z_scale=1, xy_scale=0.025, lacunarity=3, octaves=5, offset=0.25, \
+    strides=PREVIEW_STRIDES, noise_backend=NoiseBackend.Mathutils):
+    row_lines, col_lines, num_pts, faces, x, y = grid_topology(rows, cols, elev_type)
+    z = np.zeros((row_lines, col_lines))
+    known = np.zeros((row_lines, col_lines), dtype=bool)
+
+    for stride in strides:
+        lat_idx = np.ix_(lattice_lines(row_lines, stride), lattice_lines(col_lines, stride))
+        new = np.zeros_like(known)
+        new[lat_idx] = True
+        new &= ~known
+        r, c = np.nonzero(new)
+        z[r, c] = fractal_heights(elev_type, c.astype(np.float64), r.astype(np.float64), 0, noise_basis, xy_scale, lacunarity, \
+            octaves, offset, noise_backend)*z_scale
+        known |= new
+
+        if stride == 1:
+            yield stride, z.ravel().copy()
+        else:
+            yield stride, upsample_lattice(InterpType.CatmullRom, z[lat_idx], row_lines, col_lines, stride).ravel()
@@ -0,0 +1,122 @@
+import numpy as np
+
+import multiprocessing
+import queue
+import traceback
+from enum import Enum
+from multiprocessing import shared_memory
+
+from terrain_pipeline import PIPELINE_STAGES
+
+__all__ = (
+    "JobState",
+    "HeightJob"
+    )
+
+class JobState(str, Enum):
+    Running = 'running'
+    Done = 'done'
+    Cancelled = 'cancelled'
+    Failed = 'failed'
+
+#------------------------------------------------------------------------------------------------------------------
+
+# Runs the missing stages of a HeightPipeline in a worker process, reporting ('stage', name) after each one, then
+# copies the finished heights into the shared memory shm_name and reports ('done', None), or ('failed', traceback).
+def height_job_worker(pipeline, shm_name, messages):
+    try:
+        for stage in iter(pipeline.run_next_stage, None):
+            messages.put(('stage', stage))
+        z = pipeline.heights()
+        shm = shared_memory.SharedMemory(name=shm_name)
+        try:
+            np.ndarray(z.shape, dtype=np.float64, buffer=shm.buf)[:] = z
+        finally:
+            shm.close()
+        messages.put(('done', None))
+    except Exception:
+        messages.put(('failed', traceback.format_exc()))
+
+# The finished heights of a HeightPipeline, computed without blocking the caller, which calls poll() now and then
+# (e.g. from a bpy.app.timers callback) until the state is no longer Running. By default the stages run in a worker
+# process and poll() only collects its progress. in_process runs one whole stage per poll() call in this process
+# instead, so each poll() blocks for as long as its stage takes, the generate stage of a large grid included: only
+# the worker keeps the caller responsive. progress is the fraction of the pipeline's stages done and stage the last
+# one, so it advances a stage at a time either way. The worker is a daemon process, so it cannot start process pools
+# of its own: leave num_workers (and erosion's num_workers) at 0 in its pipeline. cancel() kills the worker at once,
+# even in the middle of a stage.
+class HeightJob:
+    def __init__(self, pipeline, in_process=False, mp_context=None):
+        self.pipeline = pipeline
+        self.stages_done = len(pipeline.results)
+        self.stage = None
+        self.state = JobState.Running
+        self.error = None
+        self.z = None
+        self.process = None
+        self.shm = None
+        if not in_process:
+            ctx = multiprocessing if mp_context is None else mp_context
+            num_pts = pipeline.grid()[2]
+            self.shm = shared_memory.SharedMemory(create=True, size=num_pts*np.dtype(np.float64).itemsize)
+            self.messages = ctx.Queue()
+            self.process = ctx.Process(target=height_job_worker, args=(pipeline, self.shm.name, self.messages), daemon=True)
+            self.process.start()
+
+    @property
+    def progress(self):
+        return self.stages_done/len(PIPELINE_STAGES)
+
+    def poll(self):
+        if self.state != JobState.Running:
+            return self.state
+        if self.process is None:
+            try:
+                stage = self.pipeline.run_next_stage()
+            except Exception:
+                self.finish(JobState.Failed, traceback.format_exc())
+                return self.state
+            if stage is None:
+                self.z = self.pipeline.heights()
+                self.finish(JobState.Done)
+            else:
+                self.stages_done += 1
+                self.stage = stage
+            return self.state
+
+        # A worker that has exited has flushed its messages, so wait briefly for the last ones.
+        alive = self.process.is_alive()
+        while self.state == JobState.Running:
+            try:
+                kind, value = self.messages.get_nowait() if alive else self.messages.get(timeout=0.5)
+            except queue.Empty:
+                if not alive:
+                    self.finish(JobState.Failed, "Height worker exited with code " + str(self.process.exitcode))
+                break
+            match kind:
+                case 'stage':
+                    self.stages_done += 1
+                    self.stage = value
+                case 'done':
+                    self.z = np.ndarray(self.pipeline.grid()[2], dtype=np.float64, buffer=self.shm.buf).copy()
+                    self.finish(JobState.Done)
+                case 'failed':
+                    self.finish(JobState.Failed, value)
+        return self.state
+
+    def cancel(self):
+        if self.state == JobState.Running:
+            self.finish(JobState.Cancelled)
+
+    def finish(self, state, error=None):
+        self.state = state
+        self.error = error
+        if self.process is not None:
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process.join()
+            self.messages.close()
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
@@ -0,0 +1,101 @@
+import numpy as np
+
+from height_map_utils import lattice_lines, grid_quad_faces
+
+__all__ = (
+    "LOD_STRIDES",
+    "CHUNK_SIZE",
+    "chunk_ranges",
+    "edge_error",
+    "chunk_skirt_depth",
+    "chunk_lod",
+    "lod_chain",
+    "write_lod_chain",
+    "lod_index"
+    )
+
+# Vertex strides of the LOD chain, finest first: LOD k keeps every LOD_STRIDES[k]-th row and column of a chunk.
+LOD_STRIDES = (1, 2, 4, 8)
+
+# Cells per chunk side. A multiple of the coarsest stride, so every LOD of a chunk keeps the chunk's corners and
+# neighbouring chunks sample their shared edge at the same points.
+CHUNK_SIZE = 64
+
+# (first, last) vertex lines of the chunks along an axis of n_lines vertices. Neighbouring chunks share their edge
+# line, and the last chunk may be smaller.
+def chunk_ranges(n_lines, chunk_size=CHUNK_SIZE):
+    return [(start, min(start+chunk_size, n_lines-1)) for start in range(0, n_lines-1, chunk_size)]
+
+# Largest height difference along a line of heights between the full resolution and its linear interpolation
+# through every stride-th height, i.e. how far a chunk edge at that LOD moves away from the full resolution edge.
+def edge_error(line, stride):
+    idx = lattice_lines(len(line), stride)
+    return float(np.max(np.abs(line - np.interp(np.arange(len(line)), idx, line[idx]))))
+
+# Skirt depth of a chunk of the 2D heights z2. Two chunks sample their shared edge from the same heights, so the gap
+# between any two of their LODs is at most the largest edge_error() over the strides; a skirt that deep closes it.
+def chunk_skirt_depth(z2, r_range, c_range, strides=LOD_STRIDES, cell_width=1):
+    (r0, r1), (c0, c1) = r_range, c_range
+    edges = (z2[r0, c0:c1+1], z2[r1, c0:c1+1], z2[r0:r1+1, c0], z2[r0:r1+1, c1])
+    depth = max(edge_error(edge, stride) for edge in edges for stride in strides)
+    return max(depth, 0.1*cell_width)
+
+# Vertex indices around a row_lines x col_lines grid, counter-clockwise seen from above.
+def grid_perimeter(row_lines, col_lines):
+    v_indices = np.arange(row_lines*col_lines, dtype=np.int32).reshape((row_lines, col_lines))
+    return np.concatenate([v_indices[0, :-1], v_indices[:-1, -1], v_indices[-1, :0:-1], v_indices[:0:-1, 0]])
+
+# One LOD of a chunk as a float32 (N, 3) vertex buffer and an int32 (F, 4) quad buffer: the chunk's heights at the
+# given stride, followed by a skirt, a ring of vertices skirt_depth below the chunk's edge joined to it by
+# outward-facing quads. Vertices are in world units, placed like grid_verts().
+def chunk_lod(z2, r_range, c_range, stride, cell_width=1, origin=(0,0,0), skirt_depth=0):
+    (r0, r1), (c0, c1) = r_range, c_range
+    rows = r0 + lattice_lines(r1-r0+1, stride)
+    cols = c0 + lattice_lines(c1-c0+1, stride)
+    row_lines, col_lines = len(rows), len(cols)
+    ring = grid_perimeter(row_lines, col_lines)
+    num_pts = row_lines*col_lines
+    num_ring = len(ring)
+
+    verts = np.empty((num_pts+num_ring, 3), dtype=np.float32)
+    verts[:num_pts, 0] = np.tile(cols*cell_width + origin[0], row_lines)
+    verts[:num_pts, 1] = np.repeat(rows*cell_width + origin[1], col_lines)
+    verts[:num_pts, 2] = z2[np.ix_(rows, cols)].ravel() + origin[2]
+    verts[num_pts:] = verts[ring]
+    verts[num_pts:, 2] -= skirt_depth
+
+    skirt_idx = np.arange(num_pts, num_pts+num_ring, dtype=np.int32)
+    skirt_faces = np.stack([ring, skirt_idx, np.roll(skirt_idx, -1), np.roll(ring, -1)], axis=-1)
+    faces = np.concatenate([grid_quad_faces(row_lines, col_lines), skirt_faces])
+    return verts, faces
+
+# The LOD chains of all chunks of the flat row_lines x col_lines heights z (e.g. from finish_height_map()), yielding
+# ((chunk_row, chunk_col), stride, verts, faces) for every chunk and stride in order, so a caller can write or upload
+# each buffer and drop it. skirt_depth None uses chunk_skirt_depth() for each chunk.
+def lod_chain(z, row_lines, col_lines, cell_width=1, origin=(0,0,0), chunk_size=CHUNK_SIZE, strides=LOD_STRIDES, \
+    skirt_depth=None):
+    z2 = np.reshape(z, (row_lines, col_lines))
+    for ci, r_range in enumerate(chunk_ranges(row_lines, chunk_size)):
+        for cj, c_range in enumerate(chunk_ranges(col_lines, chunk_size)):
+            depth = chunk_skirt_depth(z2, r_range, c_range, strides, cell_width) if skirt_depth is None else skirt_depth
+            for stride in strides:
+                verts, faces = chunk_lod(z2, r_range, c_range, stride, cell_width, origin, depth)
+                yield (ci, cj), stride, verts, faces
+
+# Writes the LOD chain to an .npz archive with 'chunk_<row>_<col>_lod<k>_verts' and '..._faces' buffers, plus the
+# 'strides', 'chunk_size' and 'chunk_grid' (chunk rows, chunk cols) an engine needs to stream it.
+def write_lod_chain(path, z, row_lines, col_lines, cell_width=1, origin=(0,0,0), chunk_size=CHUNK_SIZE, strides=LOD_STRIDES, \
+    skirt_depth=None, compressed=True):
+    buffers = {'strides':np.asarray(strides, dtype=np.int32), 'chunk_size':np.int32(chunk_size), \
+        'chunk_grid':np.asarray([len(chunk_ranges(row_lines, chunk_size)), len(chunk_ranges(col_lines, chunk_size))], dtype=np.int32)}
+    for (ci, cj), stride, verts, faces in lod_chain(z, row_lines, col_lines, cell_width, origin, chunk_size, strides, skirt_depth):
+        name = "chunk_"+str(ci)+"_"+str(cj)+"_lod"+str(strides.index(stride))
+        buffers[name+"_verts"] = verts
+        buffers[name+"_faces"] = faces
+    (np.savez_compressed if compressed else np.savez)(path, **buffers)
+
+# LOD level for a chunk whose center is distance away from the viewer: level k is used up to lod_distance*2^k.
+def lod_index(distance, lod_distance, num_lods=len(LOD_STRIDES)):
+    if distance <= lod_distance:
+        return 0
+    return min(int(np.ceil(np.log2(distance/lod_distance))), num_lods-1)
@@ -0,0 +1,112 @@
+import numpy as np
+
+import inspect
+
+from height_map_utils import grid_topology
+from terrain_core import height_map_funcs, add_border
+from height_cache import cached_height_map
+from erosion_utils import erode_heights
+from height_filters import filter_heights
+
+__all__ = (
+    "PIPELINE_STAGES",
+    "HeightPipeline"
+    )
+
+# Stages of a HeightPipeline in order, with the settings each one reads. A changed setting re-runs its stage and
+# every stage after it; the earlier results are kept.
+PIPELINE_STAGES = (
+    ('generate', ('generator', 'params', 'seed')),
+    ('scale', ('z_scale',)),
+    ('erode', ('erosion', 'cell_width')),
+    ('filter', ('filters',)),
+    ('border', ('chop_border',))
+    )
+
+# Keeps the result of every stage from the raw heights of a height_map_funcs generator to the finished heights. The
+# raw heights are generated at z_scale 1 and scaled by the pipeline, so changing z_scale, the border or (for the
+# mesh adapter) the mesh placement does not evaluate any noise again. params are the keyword arguments of the
+# generator's *_height_map() function, including rows and cols; seed, unless None, overrides the seed param of the
+# generators that take one.
+class HeightPipeline:
+    def __init__(self, generator, params, z_scale=1, erosion=None, chop_border=True, cell_width=1, seed=None, cache=None, \
+        mp_context=None, filters=None):
+        self.settings = {'generator':generator, 'params':dict(params), 'seed':seed, 'z_scale':z_scale, 'erosion':erosion, \
+            'cell_width':cell_width, 'chop_border':chop_border, 'filters':filters}
+        self.cache = cache
+        self.mp_context = mp_context
+        self.results = []
+
+    @property
+    def elev_type(self):
+        return height_map_funcs[self.settings['generator']][1]
+
+    def grid(self):
+        return grid_topology(self.settings['params']['rows'], self.settings['params']['cols'], self.elev_type)
+
+    # Changes settings; params is merged into the current generator params. Returns the index of the first stage
+    # that has to run again, or len(PIPELINE_STAGES) if nothing changed.
+    def update(self, **changes):
+        first = len(PIPELINE_STAGES)
+        for key, value in changes.items():
+            if key == 'params':
+                value = {**self.settings['params'], **value}
+            if key not in self.settings:
+                raise KeyError("Unknown pipeline setting " + key)
+            if self.settings[key] != value:
+                self.settings[key] = value
+                first = min(first, next(i for i, (stage, keys) in enumerate(PIPELINE_STAGES) if key in keys))
+        del self.results[first:]
+        return first
+
+    def run_stage(self, stage, z):
+        s = self.settings
+        row_lines, col_lines, num_pts, faces, x, y = self.grid()
+        match stage:
+            case 'generate':
+                params = dict(s['params'])
+                fn_params = inspect.signature(height_map_funcs[s['generator']][0]).parameters
+                if 'elev_type' in fn_params:
+                    params['elev_type'] = self.elev_type
+                if 'z_scale' in fn_params:
+                    params['z_scale'] = 1
+                if 'mp_context' in fn_params:
+                    params['mp_context'] = self.mp_context
+                if s['seed'] is not None and 'seed' in fn_params:
+                    params['seed'] = s['seed']
+                return np.asarray(cached_height_map(self.cache, s['generator'], params), dtype=np.float64)
+            case 'scale':
+                return z*s['z_scale']
+            case 'erode':
+                if s['erosion'] is None:
+                    return z
+                return erode_heights(z, row_lines, col_lines, s['cell_width'], s['erosion'], s['erosion'].get('num_workers', 0), \
+                    mp_context=self.mp_context)
+            case 'filter':
+                if not s['filters']:
+                    return z
+                return filter_heights(z, row_lines, col_lines, s['filters'])
+            case 'border':
+                if not s['chop_border']:
+                    return z
+                z = z.copy()
+                add_border(z, row_lines, col_lines, self.elev_type)
+                return z
+
+    # Runs the first stage whose result is missing and returns its name, or None if every result is there, so a
+    # caller can spread the work over several calls.
+    def run_next_stage(self):
+        if len(self.results) == len(PIPELINE_STAGES):
+            return None
+        stage = PIPELINE_STAGES[len(self.results)][0]
+        z = self.run_stage(stage, self.results[-1] if self.results else None)
+        z.setflags(write=False)
+        self.results.append(z)
+        return stage
+
+    # The finished flat heights, running only the stages whose results are missing. Read-only, since later calls
+    # return the same array.
+    def heights(self):
+        while self.run_next_stage() is not None:
+            pass
+        return self.results[-1]
@@ -0,0 +1,127 @@
+import numpy as np
+
+from math import sqrt
+
+__all__ = (
+    "SCATTER_ROUNDS",
+    "poisson_disk",
+    "sample_heights",
+    "sample_normals",
+    "slope_degrees",
+    "normal_rotations",
+    "scatter_points"
+    )
+
+# Rounds of candidates per background grid cell; more rounds fill the domain closer to a maximal sampling.
+SCATTER_ROUNDS = 6
+
+# Offsets of the background cells that can hold a point closer than the radius to a point in the center cell: the
+# 5x5 block without its center and corners, which are at least a radius away.
+NEIGHBOR_OFFSETS = np.array([(di, dj) for di in range(-2, 3) for dj in range(-2, 3) if 0 < abs(di)+abs(dj) and (abs(di), abs(dj)) != (2, 2)], dtype=np.int32)
+
+# Poisson-disk points (no two closer than radius) in [0, width) x [0, height), as an (N, 2) float64 array. The
+# background grid has cells of radius/sqrt(2), so a cell holds at most one point. Cells are processed in 9 phases
+# (cell row and column modulo 3): cells of the same phase are at least 2 cells apart, so their candidates cannot
+# conflict and a whole phase is tested at once against the cells around each candidate.
+def poisson_disk(width, height, radius, rng, rounds=SCATTER_ROUNDS):
+    cell = radius/sqrt(2)
+    grid_rows, grid_cols = int(np.ceil(height/cell)), int(np.ceil(width/cell))
+    # Point x and y per cell (NaN for empty cells), flattened with a 2 cell border so neighbour lookups need no bounds checks.
+    pad_cols = grid_cols+4
+    px = np.full((grid_rows+4)*pad_cols, np.nan)
+    py = np.full_like(px, np.nan)
+    nbr_offsets = NEIGHBOR_OFFSETS[:, 0]*pad_cols + NEIGHBOR_OFFSETS[:, 1]
+    r_idx, c_idx = np.meshgrid(np.arange(grid_rows), np.arange(grid_cols), indexing='ij')
+    phases = [(r_idx[pr::3, pc::3].ravel(), c_idx[pr::3, pc::3].ravel()) for pr in range(3) for pc in range(3)]
+    phases = [(rows, cols, (rows+2)*pad_cols + cols+2) for rows, cols in phases]
+
+    for _ in range(rounds):
+        for rows, cols, idx in phases:
+            empty = np.isnan(px[idx])
+            rows, cols, idx = rows[empty], cols[empty], idx[empty]
+            cx = (cols + rng.random(len(idx)))*cell
+            cy = (rows + rng.random(len(idx)))*cell
+            inside = (cx < width) & (cy < height)
+            cx, cy, idx = cx[inside], cy[inside], idx[inside]
+
+            nbrs = idx[:, None] + nbr_offsets
+            too_close = (px[nbrs] - cx[:, None])**2 + (py[nbrs] - cy[:, None])**2 < radius*radius
+            ok = ~too_close.any(axis=1)
+            px[idx[ok]] = cx[ok]
+            py[idx[ok]] = cy[ok]
+
+    filled = ~np.isnan(px)
+    return np.stack([px[filled], py[filled]], axis=-1)
+
+def bilinear_cells(z2, gx, gy):
+    c = np.clip(np.floor(gx).astype(np.intp), 0, z2.shape[1]-2)
+    r = np.clip(np.floor(gy).astype(np.intp), 0, z2.shape[0]-2)
+    return r, c, gx - c, gy - r
+
+# Heights of the 2D heights z2 at the grid coordinates (gx, gy) (column, row), bilinearly interpolated.
+def sample_heights(z2, gx, gy):
+    r, c, tx, ty = bilinear_cells(z2, gx, gy)
+    z0 = z2[r, c] + (z2[r, c+1] - z2[r, c])*tx
+    z1 = z2[r+1, c] + (z2[r+1, c+1] - z2[r+1, c])*tx
+    return z0 + (z1 - z0)*ty
+
+# Unit normals of the bilinear height surface at the grid coordinates (gx, gy), for cells cell_width wide.
+def sample_normals(z2, gx, gy, cell_width=1):
+    r, c, tx, ty = bilinear_cells(z2, gx, gy)
+    z00, z01, z10, z11 = z2[r, c], z2[r, c+1], z2[r+1, c], z2[r+1, c+1]
+    dzdx = ((z01 - z00)*(1-ty) + (z11 - z10)*ty)/cell_width
+    dzdy = ((z10 - z00)*(1-tx) + (z11 - z01)*tx)/cell_width
+    normals = np.stack([-dzdx, -dzdy, np.ones_like(dzdx)], axis=-1)
+    return normals/np.linalg.norm(normals, axis=-1, keepdims=True)
+
+def slope_degrees(normals):
+    return np.degrees(np.arccos(np.clip(normals[:, 2], -1, 1)))
+
+# Blender XYZ Euler angles that turn an instance's +Z to normals and then spin it by angle about the normal.
+def normal_rotations(normals, angle):
+    nx, ny, nz = normals[:, 0], normals[:, 1], normals[:, 2]
+    k = 1/(1 + nz)
+    # Rotation taking +Z to the normal (Rodrigues' formula for the axis Z x n), times a rotation about Z.
+    align = np.empty((len(normals), 3, 3))
+    align[:, 0] = np.stack([1 - nx*nx*k, -nx*ny*k, nx], axis=-1)
+    align[:, 1] = np.stack([-nx*ny*k, 1 - ny*ny*k, ny], axis=-1)
+    align[:, 2] = np.stack([-nx, -ny, nz], axis=-1)
+    cos_a, sin_a = np.cos(angle), np.sin(angle)
+    spin = np.zeros_like(align)
+    spin[:, 0, 0], spin[:, 0, 1], spin[:, 1, 0], spin[:, 1, 1], spin[:, 2, 2] = cos_a, -sin_a, sin_a, cos_a, 1
+    m = align @ spin
+    return np.stack([np.arctan2(m[:, 2, 1], m[:, 2, 2]), -np.arcsin(np.clip(m[:, 2, 0], -1, 1)), \
+        np.arctan2(m[:, 1, 0], m[:, 0, 0])], axis=-1)
+
+# Scatters instances on the flat row_lines x col_lines heights z (e.g. from finish_height_map(), so they match the
+# mesh of the same cell_width and origin): Poisson-disk points radius apart (in world units), kept where the slope
+# in degrees and the height (before origin) are within slope_range and height_range. Returns float32 (N, 3) world
+# positions, unit normals, XYZ Euler rotations (a random spin about +Z, or about the normal if align) and uniform
+# scales drawn from scale_range.
+def scatter_points(z, row_lines, col_lines, radius, cell_width=1, origin=(0,0,0), slope_range=(0, 90), \
+    height_range=(-np.inf, np.inf), align=False, scale_range=(1, 1), seed=0, rounds=SCATTER_ROUNDS):
+    rng = np.random.default_rng(seed)
+    z2 = np.reshape(z, (row_lines, col_lines))
+    pts = poisson_disk((col_lines-1)*cell_width, (row_lines-1)*cell_width, radius, rng, rounds)
+    gx, gy = pts[:, 0]/cell_width, pts[:, 1]/cell_width
+
+    heights = sample_heights(z2, gx, gy)
+    normals = sample_normals(z2, gx, gy, cell_width)
+    slopes = slope_degrees(normals)
+    keep = (slopes >= slope_range[0]) & (slopes <= slope_range[1]) & (heights >= height_range[0]) & (heights <= height_range[1])
+    pts, heights, normals = pts[keep], heights[keep], normals[keep]
+
+    num_pts = len(pts)
+    positions = np.empty((num_pts, 3), dtype=np.float32)
+    positions[:, 0] = pts[:, 0] + origin[0]
+    positions[:, 1] = pts[:, 1] + origin[1]
+    positions[:, 2] = heights + origin[2]
+
+    angle = rng.uniform(0, 2*np.pi, num_pts)
+    if align:
+        rotations = normal_rotations(normals, angle).astype(np.float32)
+    else:
+        rotations = np.zeros((num_pts, 3), dtype=np.float32)
+        rotations[:, 2] = angle
+    scales = np.repeat(rng.uniform(scale_range[0], scale_range[1], num_pts).astype(np.float32)[:, None], 3, axis=1)
+    return positions, normals.astype(np.float32), rotations, scales
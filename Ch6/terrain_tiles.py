@@ -0,0 +1,196 @@
+import numpy as np
+
+from collections import OrderedDict
+from math import floor, ceil, pow
+
+from height_map_utils import ElevType, catmull_rom_axis
+from noise_utils import NoiseBackend, noise_array, hash_uniform, hybrid_multi_fractal_array, multi_fractal_array, hetero_terrain_array
+
+__all__ = (
+    "tile_elev_types",
+    "seed_offset",
+    "fbm_lattice_heights",
+    "fbm_lattice_heights_at",
+    "fractal_heights",
+    "gen_random_heights",
+    "terrain_heights",
+    "TerrainTileStream"
+    )
+
+tile_elev_types = [ElevType.Random, ElevType.HybridMultiFractal, ElevType.BlenderMultiFractal, ElevType.BlenderHeteroTerrain]
+
+# Seed 0 evaluates the noise fields at the same positions as the gen_*_mesh functions; other seeds shift them by a
+# hashed offset, so every seed gets its own part of the (fixed) noise field.
+def seed_offset(seed):
+    if seed == 0:
+        return 0.0, 0.0
+    o = hash_uniform(seed, 0x5EED, np.array([0, 1]), np.array([0, 0]))
+    return o[0]*4096.0, o[1]*4096.0
+
+# Random lattice value at integer world lattice coords, for the fbm of gen_random_fbm_mesh. UNIFORM draws come from
+# the stateless hash instead of np.random, so any lattice point can be regenerated on its own.
+def sample_lattice_values(seed, octave, noise_basis, h_min, h_max, lat_x, lat_y):
+    if noise_basis == 'UNIFORM':
+        return h_min + (h_max-h_min)*hash_uniform(seed, octave, lat_x, lat_y)
+    ox, oy = seed_offset(seed)
+    coords = np.column_stack([lat_x*0.05 + ox, lat_y*0.05 + oy, np.ones(len(lat_x))])
+    return noise_array(coords, noise_basis)*20
+
+# Sum of octaves of Catmull-Rom upsampled lattice values at arbitrary world grid positions xs (cols) and ys (rows).
+# The lattice is anchored to world multiples of the octave's step, so neighboring tiles see the same control points.
+def fbm_lattice_heights(seed, noise_basis, xs, ys, unit_size=5, h_min=-50, h_max=50, num_octaves=4):
+    z = np.zeros((len(ys), len(xs)))
+    fbm_unit_size = pow(2, num_octaves-1)*unit_size
+    for i in range(num_octaves):
+        dp = int(pow(2, i))
+        step_size = floor(fbm_unit_size//dp)
+        if step_size < 1:
+            break
+        kx = np.arange(floor(xs.min()/step_size)-1, ceil(xs.max()/step_size)+2)
+        ky = np.arange(floor(ys.min()/step_size)-1, ceil(ys.max()/step_size)+2)
+        lat_x = np.tile(kx*step_size, len(ky))
+        lat_y = np.repeat(ky*step_size, len(kx))
+        lat = sample_lattice_values(seed, i, noise_basis, h_min, h_max, lat_x, lat_y).reshape(len(ky), len(kx))
+        lat_cols = catmull_rom_axis(lat, xs, kx*step_size, 1)
+        z += (1/dp)*catmull_rom_axis(lat_cols, ys, ky*step_size, 0)
+    return z
+
+def catmull_rom_weights(t):
+    t2 = t*t
+    t3 = t2*t
+    return [0.5*(-t + 2*t2 - t3), 0.5*(2 - 5*t2 + 3*t3), 0.5*(t + 4*t2 - 3*t3), 0.5*(t3 - t2)]
+
+# Same field as fbm_lattice_heights(), but at scattered grid positions (x[i], y[i]) instead of on a grid: each point
+# reads its own 4x4 block of lattice values, combined in the same order, so both agree at shared positions.
+def fbm_lattice_heights_at(seed, noise_basis, x, y, unit_size=5, h_min=-50, h_max=50, num_octaves=4):
+    z = np.zeros(len(x))
+    fbm_unit_size = pow(2, num_octaves-1)*unit_size
+    for i in range(num_octaves):
+        dp = int(pow(2, i))
+        step_size = floor(fbm_unit_size//dp)
+        if step_size < 1:
+            break
+        kx = np.floor(x/step_size).astype(np.int64)
+        ky = np.floor(y/step_size).astype(np.int64)
+        wx = catmull_rom_weights((x-kx*step_size)/step_size)
+        wy = catmull_rom_weights((y-ky*step_size)/step_size)
+        z_oct = 0
+        for j in range(4):
+            row = 0
+            for k in range(4):
+                lat = sample_lattice_values(seed, i, noise_basis, h_min, h_max, (kx+k-1)*step_size, (ky+j-1)*step_size)
+                row = row + wx[k]*lat
+            z_oct = z_oct + wy[j]*row
+        z += (1/dp)*z_oct
+    return z
+
+# Unscaled fractal heights at grid positions x (col) and y (row), with the fixed parameters of gen_bl_fractal_mesh
+# and the free ones of gen_hybrid_multi_fractal_mesh.
+def fractal_heights(elev_type, x, y, seed=0, noise_basis='PERLIN_NEW', xy_scale=0.025, lacunarity=3, octaves=5, offset=0.25, \
+    noise_backend=NoiseBackend.NumPy):
+    ox, oy = seed_offset(seed)
+    ones = np.ones(len(x))
+    match elev_type:
+        case ElevType.HybridMultiFractal:
+            coords = np.column_stack([x*xy_scale + ox, y*xy_scale + oy, ones])
+            return hybrid_multi_fractal_array(coords, 0.25, lacunarity, octaves, offset, noise_basis, noise_backend)
+        case ElevType.BlenderMultiFractal:
+            coords = np.column_stack([x*0.01 + ox, y*0.01 + oy, ones])
+            return multi_fractal_array(coords, 0.7, 2.0, 8, noise_basis, noise_backend)
+        case ElevType.BlenderHeteroTerrain:
+            coords = np.column_stack([x*0.01 + ox, y*0.01 + oy, ones])
+            return hetero_terrain_array(coords, 0.25, 2, 10, 0.5, noise_basis, noise_backend)
+
+# Heights of the Random ElevType at grid positions x (col) and y (row), shared by random_height_map() and its bands in
+# parallel_heights(). Random draws come from the np.random.Generator rng (only UNIFORM draws any); seeds of the
+# *_height_map() functions are spread over child streams with spawn_seeds(). rng None draws from a Generator seeded
+# with 0, like the seed defaults of the *_height_map() functions, so the heights are reproducible either way.
+def gen_random_heights(h_min, h_max, noise_basis, x, y, noise_backend=NoiseBackend.NumPy, rng=None):
+    if noise_basis=='UNIFORM':
+        return (np.random.default_rng(0) if rng is None else rng).uniform(h_min, h_max, x.shape)
+    coords = np.column_stack([x*0.05, y*0.05, np.ones(len(x))])
+    return noise_array(coords, noise_basis, noise_backend)*20
+
+# Stateless height query at arbitrary world positions (x[i], y[i]), e.g. for spawn points or navigation, without
+# building a grid. With the same cell_width, origin and parameters (and seed 0), the fractal types give the vertex
+# heights of the meshes built by gen_hybrid_multi_fractal_mesh and gen_bl_fractal_mesh (before chop_border and
+# modifiers), and positions in between follow the same continuous field. noise_backend defaults to Blender's noise, as
+# those adapters do; pass the backend the mesh was built with. Random gives the heights of the TerrainTileStream
+# tiles: gen_random_mesh interpolates a lattice whose random streams follow the grid's shape and bands, which no
+# query at free positions can reproduce.
+def terrain_heights(elev_type, x, y, seed=0, noise_basis='PERLIN_NEW', z_scale=1, cell_width=1, origin=(0,0,0), \
+    xy_scale=0.025, lacunarity=3, octaves=5, offset=0.25, unit_size=5, h_min=-50, h_max=50, num_octaves=4, \
+    noise_backend=NoiseBackend.Mathutils):
+    gx = (np.asarray(x, dtype=np.float64).ravel() - origin[0])/cell_width
+    gy = (np.asarray(y, dtype=np.float64).ravel() - origin[1])/cell_width
+    if elev_type == ElevType.Random:
+        return fbm_lattice_heights_at(seed, noise_basis, gx, gy, unit_size, h_min, h_max, num_octaves) + origin[2]
+    return fractal_heights(elev_type, gx, gy, seed, noise_basis, xy_scale, lacunarity, octaves, offset, \
+        noise_backend)*z_scale + origin[2]
+
+#------------------------------------------------------------------------------------------------------------------
+
+# Streams heightmap tiles of (tile_size+1)x(tile_size+1) vertices for integer tile coords (tx, ty). Tile (tx, ty)
+# starts at world grid vertex (tx*tile_size, ty*tile_size), and neighboring tiles share their border vertices, which
+# are evaluated from the same world positions, so the edges match exactly. Heights only depend on the parameters,
+# seed and tile coords. Recently used tiles are kept in an LRU cache bounded by cache_bytes.
+class TerrainTileStream:
+    def __init__(self, elev_type, tile_size=128, seed=0, noise_basis='PERLIN_NEW', z_scale=1, cache_bytes=256*1024*1024, \
+        xy_scale=0.025, lacunarity=3, octaves=5, offset=0.25, unit_size=5, h_min=-50, h_max=50, num_octaves=4, dtype=np.float32):
+        self.elev_type = ElevType(elev_type)
+        self.tile_size = tile_size
+        self.seed = seed
+        self.noise_basis = noise_basis
+        self.z_scale = z_scale
+        self.cache_bytes = cache_bytes
+        self.xy_scale = xy_scale
+        self.lacunarity = lacunarity
+        self.octaves = octaves
+        self.offset = offset
+        self.unit_size = unit_size
+        self.h_min = h_min
+        self.h_max = h_max
+        self.num_octaves = num_octaves
+        self.dtype = dtype
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+
+    def tile_origin(self, tx, ty):
+        return tx*self.tile_size, ty*self.tile_size
+
+    def tile_of(self, x, y):
+        return floor(x/self.tile_size), floor(y/self.tile_size)
+
+    def eval_tile(self, tx, ty):
+        x0, y0 = self.tile_origin(tx, ty)
+        xs = np.arange(x0, x0+self.tile_size+1, dtype=np.float64)
+        ys = np.arange(y0, y0+self.tile_size+1, dtype=np.float64)
+        if self.elev_type == ElevType.Random:
+            return fbm_lattice_heights(self.seed, self.noise_basis, xs, ys, self.unit_size, self.h_min, self.h_max, \
+                self.num_octaves)
+
+        x = np.tile(xs, len(ys))
+        y = np.repeat(ys, len(xs))
+        z = fractal_heights(self.elev_type, x, y, self.seed, self.noise_basis, self.xy_scale, self.lacunarity, self.octaves, \
+            self.offset)
+        return (z*self.z_scale).reshape(len(ys), len(xs))
+
+    def tile(self, tx, ty):
+        key = (tx, ty)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        z = self.eval_tile(tx, ty).astype(self.dtype)
+        z.setflags(write=False)
+        self.cache[key] = z
+        self.cached_bytes += z.nbytes
+        while self.cached_bytes > self.cache_bytes and len(self.cache) > 1:
+            old_key, old_z = self.cache.popitem(last=False)
+            self.cached_bytes -= old_z.nbytes
+        return z
+
+    # Tiles within radius tiles of the one containing world grid position (x, y), e.g. around the camera.
+    def tiles_around(self, x, y, radius=1):
+        cx, cy = self.tile_of(x, y)
+        return {(tx, ty): self.tile(tx, ty) for ty in range(cy-radius, cy+radius+1) for tx in range(cx-radius, cx+radius+1)}